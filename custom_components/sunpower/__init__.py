@@ -1,310 +1,83 @@
 """The sunpower integration."""
 
+import asyncio
 import logging
-import time
-from datetime import timedelta
 
+import homeassistant.helpers.config_validation as cv
 import voluptuous as vol
 from homeassistant.config_entries import (
     SOURCE_IMPORT,
     ConfigEntry,
 )
 from homeassistant.core import HomeAssistant
-from homeassistant.helpers.update_coordinator import (
-    DataUpdateCoordinator,
-    UpdateFailed,
-)
 
 from .const import (
-    BATTERY_DEVICE_TYPE,
+    ADAPTIVE_TIMEOUT,
+    DEFAULT_ADAPTIVE_TIMEOUT,
+    DEFAULT_MAX_CONCURRENT_POLLS,
+    DEFAULT_NIGHT_UPDATE_INTERVAL,
+    DEFAULT_RETIRE_DEVICE_DAYS,
+    DEFAULT_STALE_GRACE_PERIOD,
     DEFAULT_SUNPOWER_UPDATE_INTERVAL,
     DEFAULT_SUNVAULT_UPDATE_INTERVAL,
     DOMAIN,
-    ESS_DEVICE_TYPE,
-    HUBPLUS_DEVICE_TYPE,
-    INVERTER_DEVICE_TYPE,
-    METER_DEVICE_TYPE,
-    PVS_DEVICE_TYPE,
-    SETUP_TIMEOUT_MIN,
+    NIGHT_UPDATE_INTERVAL,
+    REQUESTS_PER_HOUR,
+    RETIRE_DEVICE_DAYS,
+    STALE_GRACE_PERIOD,
     SUNPOWER_COORDINATOR,
+    SUNPOWER_ENTRY_CONFIG,
+    SUNPOWER_GOVERNOR,
+    SUNPOWER_GOVERNORS,
     SUNPOWER_HOST,
+    SUNPOWER_MAX_CONCURRENT_POLLS,
     SUNPOWER_OBJECT,
+    SUNPOWER_POLL_LIMITER,
+    SUNPOWER_POLLER,
     SUNPOWER_UPDATE_INTERVAL,
-    SUNVAULT_DEVICE_TYPE,
+    SUNVAULT_COORDINATOR,
     SUNVAULT_UPDATE_INTERVAL,
 )
+from .coordinator import (
+    SunPowerPoller,
+    snapshot_store,
+)
 from .sunpower import (
-    ConnectionException,
-    ParseException,
-    SunPowerMonitor,
+    DEFAULT_REQUESTS_PER_HOUR,
+    PVSGovernor,
 )
 
 _LOGGER = logging.getLogger(__name__)
 
-CONFIG_SCHEMA = vol.Schema({DOMAIN: vol.Schema({})}, extra=vol.ALLOW_EXTRA)
+CONFIG_SCHEMA = vol.Schema(
+    {
+        DOMAIN: vol.Schema(
+            {
+                vol.Optional(
+                    SUNPOWER_MAX_CONCURRENT_POLLS,
+                    default=DEFAULT_MAX_CONCURRENT_POLLS,
+                ): cv.positive_int,
+            },
+            extra=vol.ALLOW_EXTRA,
+        ),
+    },
+    extra=vol.ALLOW_EXTRA,
+)
 
 PLATFORMS = ["sensor", "binary_sensor"]
 
-PREVIOUS_PVS_SAMPLE_TIME = 0
-PREVIOUS_PVS_SAMPLE = {}
-PREVIOUS_ESS_SAMPLE_TIME = 0
-PREVIOUS_ESS_SAMPLE = {}
-
-
-def create_vmeter(data):
-    # Create a virtual 'METER' that uses the sum of inverters
-    kwh = 0.0
-    kw = 0.0
-    amps = 0.0
-    freq = []
-    volts = []
-    state = "working"
-    for _serial, inverter in data.get(INVERTER_DEVICE_TYPE, {}).items():
-        if "STATE" in inverter and inverter["STATE"] != "working":
-            state = inverter["STATE"]
-        kwh += float(inverter.get("ltea_3phsum_kwh", "0"))
-        kw += float(inverter.get("p_mppt1_kw", "0"))
-        amps += float(inverter.get("i_3phsum_a", "0"))
-        if "freq_hz" in inverter:
-            freq.append(float(inverter["freq_hz"]))
-        if "vln_3phavg_v" in inverter:
-            volts.append(float(inverter["vln_3phavg_v"]))
-
-    freq_avg = sum(freq) / len(freq) if len(freq) > 0 else None
-    volts_avg = sum(volts) / len(volts) if len(volts) > 0 else None
-
-    pvs_serial = next(iter(data[PVS_DEVICE_TYPE]))  # only one PVS
-    vmeter_serial = f"{pvs_serial}pv"
-    data.setdefault(METER_DEVICE_TYPE, {})[vmeter_serial] = {
-        "SERIAL": vmeter_serial,
-        "TYPE": "PVS-METER-P",
-        "STATE": state,
-        "MODEL": "Virtual",
-        "DESCR": f"Power Meter {vmeter_serial}",
-        "DEVICE_TYPE": "Power Meter",
-        "interface": "virtual",
-        "SWVER": "1.0",
-        "HWVER": "Virtual",
-        "origin": "virtual",
-        "net_ltea_3phsum_kwh": kwh,
-        "p_3phsum_kw": kw,
-        "freq_hz": freq_avg,
-        "i_a": amps,
-        "v12_v": volts_avg,
-    }
-    return data
-
-
-def convert_sunpower_data(sunpower_data):
-    """Convert PVS data into indexable format data[device_type][serial]"""
-    data = {}
-    for device in sunpower_data["devices"]:
-        data.setdefault(device["DEVICE_TYPE"], {})[device["SERIAL"]] = device
-
-    create_vmeter(data)
-
-    return data
-
-
-def convert_ess_data(ess_data, data):
-    """Do all the gymnastics to Integrate ESS data from its unique data source into the PVS data"""
-    sunvault_amperages = []
-    sunvault_voltages = []
-    sunvault_temperatures = []
-    sunvault_customer_state_of_charges = []
-    sunvault_system_state_of_charges = []
-    sunvault_power = []
-    sunvault_power_inputs = []
-    sunvault_power_outputs = []
-    sunvault_state = "working"
-    for device in ess_data["ess_report"]["battery_status"]:
-        data[BATTERY_DEVICE_TYPE][device["serial_number"]]["battery_amperage"] = device[
-            "battery_amperage"
-        ]["value"]
-        data[BATTERY_DEVICE_TYPE][device["serial_number"]]["battery_voltage"] = device[
-            "battery_voltage"
-        ]["value"]
-        data[BATTERY_DEVICE_TYPE][device["serial_number"]]["customer_state_of_charge"] = device[
-            "customer_state_of_charge"
-        ]["value"]
-        data[BATTERY_DEVICE_TYPE][device["serial_number"]]["system_state_of_charge"] = device[
-            "system_state_of_charge"
-        ]["value"]
-        data[BATTERY_DEVICE_TYPE][device["serial_number"]]["temperature"] = device["temperature"][
-            "value"
-        ]
-        if data[BATTERY_DEVICE_TYPE][device["serial_number"]]["STATE"] != "working":
-            sunvault_state = data[BATTERY_DEVICE_TYPE][device["serial_number"]]["STATE"]
-        sunvault_amperages.append(device["battery_amperage"]["value"])
-        sunvault_voltages.append(device["battery_voltage"]["value"])
-        sunvault_temperatures.append(device["temperature"]["value"])
-        sunvault_customer_state_of_charges.append(
-            device["customer_state_of_charge"]["value"],
-        )
-        sunvault_system_state_of_charges.append(device["system_state_of_charge"]["value"])
-        sunvault_power.append(sunvault_amperages[-1] * sunvault_voltages[-1])
-        if sunvault_amperages[-1] < 0:
-            sunvault_power_outputs.append(
-                abs(sunvault_amperages[-1] * sunvault_voltages[-1]),
-            )
-            sunvault_power_inputs.append(0)
-        elif sunvault_amperages[-1] > 0:
-            sunvault_power_inputs.append(sunvault_amperages[-1] * sunvault_voltages[-1])
-            sunvault_power_outputs.append(0)
-        else:
-            sunvault_power_inputs.append(0)
-            sunvault_power_outputs.append(0)
-    for device in ess_data["ess_report"]["ess_status"]:
-        data[ESS_DEVICE_TYPE][device["serial_number"]]["enclosure_humidity"] = device[
-            "enclosure_humidity"
-        ]["value"]
-        data[ESS_DEVICE_TYPE][device["serial_number"]]["enclosure_temperature"] = device[
-            "enclosure_temperature"
-        ]["value"]
-        data[ESS_DEVICE_TYPE][device["serial_number"]]["agg_power"] = device["ess_meter_reading"][
-            "agg_power"
-        ]["value"]
-        data[ESS_DEVICE_TYPE][device["serial_number"]]["meter_a_current"] = device[
-            "ess_meter_reading"
-        ]["meter_a"]["reading"]["current"]["value"]
-        data[ESS_DEVICE_TYPE][device["serial_number"]]["meter_a_power"] = device[
-            "ess_meter_reading"
-        ]["meter_a"]["reading"]["power"]["value"]
-        data[ESS_DEVICE_TYPE][device["serial_number"]]["meter_a_voltage"] = device[
-            "ess_meter_reading"
-        ]["meter_a"]["reading"]["voltage"]["value"]
-        data[ESS_DEVICE_TYPE][device["serial_number"]]["meter_b_current"] = device[
-            "ess_meter_reading"
-        ]["meter_b"]["reading"]["current"]["value"]
-        data[ESS_DEVICE_TYPE][device["serial_number"]]["meter_b_power"] = device[
-            "ess_meter_reading"
-        ]["meter_b"]["reading"]["power"]["value"]
-        data[ESS_DEVICE_TYPE][device["serial_number"]]["meter_b_voltage"] = device[
-            "ess_meter_reading"
-        ]["meter_b"]["reading"]["voltage"]["value"]
-    if True:
-        device = ess_data["ess_report"]["hub_plus_status"]
-        data[HUBPLUS_DEVICE_TYPE][device["serial_number"]]["contactor_position"] = device[
-            "contactor_position"
-        ]
-        data[HUBPLUS_DEVICE_TYPE][device["serial_number"]]["grid_frequency_state"] = device[
-            "grid_frequency_state"
-        ]
-        data[HUBPLUS_DEVICE_TYPE][device["serial_number"]]["grid_phase1_voltage"] = device[
-            "grid_phase1_voltage"
-        ]["value"]
-        data[HUBPLUS_DEVICE_TYPE][device["serial_number"]]["grid_phase2_voltage"] = device[
-            "grid_phase2_voltage"
-        ]["value"]
-        data[HUBPLUS_DEVICE_TYPE][device["serial_number"]]["grid_voltage_state"] = device[
-            "grid_voltage_state"
-        ]
-        data[HUBPLUS_DEVICE_TYPE][device["serial_number"]]["hub_humidity"] = device[
-            "hub_humidity"
-        ]["value"]
-        data[HUBPLUS_DEVICE_TYPE][device["serial_number"]]["hub_temperature"] = device[
-            "hub_temperature"
-        ]["value"]
-        data[HUBPLUS_DEVICE_TYPE][device["serial_number"]]["inverter_connection_voltage"] = device[
-            "inverter_connection_voltage"
-        ]["value"]
-        data[HUBPLUS_DEVICE_TYPE][device["serial_number"]]["load_frequency_state"] = device[
-            "load_frequency_state"
-        ]
-        data[HUBPLUS_DEVICE_TYPE][device["serial_number"]]["load_phase1_voltage"] = device[
-            "load_phase1_voltage"
-        ]["value"]
-        data[HUBPLUS_DEVICE_TYPE][device["serial_number"]]["load_phase2_voltage"] = device[
-            "load_phase2_voltage"
-        ]["value"]
-        data[HUBPLUS_DEVICE_TYPE][device["serial_number"]]["main_voltage"] = device[
-            "main_voltage"
-        ]["value"]
-    if True:
-        # Generate a usable serial number for this virtual device, use PVS serial as base
-        # since we must be talking through one and it has a serial
-        pvs_serial = next(iter(data[PVS_DEVICE_TYPE]))  # only one PVS
-        sunvault_serial = f"sunvault_{pvs_serial}"
-        data[SUNVAULT_DEVICE_TYPE] = {sunvault_serial: {}}
-        data[SUNVAULT_DEVICE_TYPE][sunvault_serial]["sunvault_amperage"] = sum(
-            sunvault_amperages,
-        )
-        data[SUNVAULT_DEVICE_TYPE][sunvault_serial]["sunvault_voltage"] = sum(
-            sunvault_voltages,
-        ) / len(sunvault_voltages)
-        data[SUNVAULT_DEVICE_TYPE][sunvault_serial]["sunvault_temperature"] = sum(
-            sunvault_temperatures,
-        ) / len(sunvault_temperatures)
-        data[SUNVAULT_DEVICE_TYPE][sunvault_serial]["sunvault_customer_state_of_charge"] = sum(
-            sunvault_customer_state_of_charges,
-        ) / len(sunvault_customer_state_of_charges)
-        data[SUNVAULT_DEVICE_TYPE][sunvault_serial]["sunvault_system_state_of_charge"] = sum(
-            sunvault_system_state_of_charges,
-        ) / len(sunvault_system_state_of_charges)
-        data[SUNVAULT_DEVICE_TYPE][sunvault_serial]["sunvault_power_input"] = sum(
-            sunvault_power_inputs,
-        )
-        data[SUNVAULT_DEVICE_TYPE][sunvault_serial]["sunvault_power_output"] = sum(
-            sunvault_power_outputs,
-        )
-        data[SUNVAULT_DEVICE_TYPE][sunvault_serial]["sunvault_power"] = sum(sunvault_power)
-        data[SUNVAULT_DEVICE_TYPE][sunvault_serial]["STATE"] = sunvault_state
-        data[SUNVAULT_DEVICE_TYPE][sunvault_serial]["SERIAL"] = sunvault_serial
-        data[SUNVAULT_DEVICE_TYPE][sunvault_serial]["SWVER"] = "1.0"
-        data[SUNVAULT_DEVICE_TYPE][sunvault_serial]["HWVER"] = "Virtual"
-        data[SUNVAULT_DEVICE_TYPE][sunvault_serial]["DESCR"] = "Virtual SunVault"
-        data[SUNVAULT_DEVICE_TYPE][sunvault_serial]["MODEL"] = "Virtual SunVault"
-    return data
-
-
-def sunpower_fetch(
-    sunpower_monitor,
-    sunpower_update_invertal,
-    sunvault_update_invertal,
-):
-    """Basic data fetch routine to get and reformat sunpower data to a dict of device
-    type and serial #"""
-    global PREVIOUS_PVS_SAMPLE_TIME
-    global PREVIOUS_PVS_SAMPLE
-    global PREVIOUS_ESS_SAMPLE_TIME
-    global PREVIOUS_ESS_SAMPLE
-
-    sunpower_data = PREVIOUS_PVS_SAMPLE
-    ess_data = PREVIOUS_ESS_SAMPLE
-    use_ess = False
-    data = None
-
-    try:
-        if (time.time() - PREVIOUS_PVS_SAMPLE_TIME) >= (sunpower_update_invertal - 1):
-            PREVIOUS_PVS_SAMPLE_TIME = time.time()
-            sunpower_data = sunpower_monitor.device_list()
-            PREVIOUS_PVS_SAMPLE = sunpower_data
-            _LOGGER.debug("got PVS data %s", sunpower_data)
-    except (ParseException, ConnectionException) as error:
-        raise UpdateFailed from error
-
-    data = convert_sunpower_data(sunpower_data)
-    if ESS_DEVICE_TYPE in data:  # Look for an ESS in PVS data
-        use_ess = True
-
-    try:
-        if use_ess and (time.time() - PREVIOUS_ESS_SAMPLE_TIME) >= (sunvault_update_invertal - 1):
-            PREVIOUS_ESS_SAMPLE_TIME = time.time()
-            ess_data = sunpower_monitor.energy_storage_system_status()
-            PREVIOUS_ESS_SAMPLE = ess_data
-            _LOGGER.debug("got ESS data %s", ess_data)
-    except (ParseException, ConnectionException) as error:
-        raise UpdateFailed from error
-
-    try:
-        if use_ess:
-            convert_ess_data(
-                ess_data,
-                data,
-            )  # ess converter appends to items in existing PVS structure
-        return data
-    except ParseException as error:
-        raise UpdateFailed from error
+# Options that only change how the PVS is polled, changing them does not reload the entry
+LIVE_OPTIONS = frozenset(
+    (
+        SUNPOWER_UPDATE_INTERVAL,
+        SUNVAULT_UPDATE_INTERVAL,
+        STALE_GRACE_PERIOD,
+        ADAPTIVE_TIMEOUT,
+        REQUESTS_PER_HOUR,
+        NIGHT_UPDATE_INTERVAL,
+        RETIRE_DEVICE_DAYS,
+    ),
+)
 
 
 async def async_setup(hass: HomeAssistant, config: dict):
@@ -312,7 +85,16 @@ async def async_setup(hass: HomeAssistant, config: dict):
     hass.data.setdefault(DOMAIN, {})
     conf = config.get(DOMAIN)
 
-    if not conf:
+    # Shared by every PVS entry, caps how many PVS requests run at the same time
+    max_concurrent_polls = DEFAULT_MAX_CONCURRENT_POLLS
+    if conf:
+        max_concurrent_polls = conf.get(SUNPOWER_MAX_CONCURRENT_POLLS, max_concurrent_polls)
+    hass.data[DOMAIN][SUNPOWER_POLL_LIMITER] = asyncio.Semaphore(max_concurrent_polls)
+    # One governor per PVS host, kept across reloads and setup retries so they cannot
+    # reset its request budget or circuit breaker
+    hass.data[DOMAIN][SUNPOWER_GOVERNORS] = {}
+
+    if not conf or SUNPOWER_HOST not in conf:
         return True
 
     hass.async_create_task(
@@ -331,61 +113,42 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry):
     entry_id = entry.entry_id
 
     hass.data[DOMAIN].setdefault(entry_id, {})
-    sunpower_monitor = SunPowerMonitor(entry.data[SUNPOWER_HOST])
-    sunpower_update_invertal = entry.options.get(
-        SUNPOWER_UPDATE_INTERVAL,
-        DEFAULT_SUNPOWER_UPDATE_INTERVAL,
-    )
-    sunvault_update_invertal = entry.options.get(
-        SUNVAULT_UPDATE_INTERVAL,
-        DEFAULT_SUNVAULT_UPDATE_INTERVAL,
-    )
+    options = poll_options(entry)
+    requests_per_hour = entry.options.get(REQUESTS_PER_HOUR, DEFAULT_REQUESTS_PER_HOUR)
 
-    async def async_update_data():
-        """Fetch data from API endpoint, used by coordinator to get mass data updates"""
-        _LOGGER.debug("Updating SunPower data")
-        return await hass.async_add_executor_job(
-            sunpower_fetch,
-            sunpower_monitor,
-            sunpower_update_invertal,
-            sunvault_update_invertal,
-        )
-
-    # This could be better, taking the shortest time interval as the coordinator update is fine
-    # if the long interval is an even multiple of the short or *much* smaller
-    coordinator_interval = (
-        sunvault_update_invertal
-        if sunvault_update_invertal < sunpower_update_invertal
-        else sunpower_update_invertal
+    _LOGGER.debug(
+        f"Intervals: Sunpower {options['pvs_interval']} Sunvault {options['ess_interval']}",
     )
 
-    _LOGGER.debug(
-        f"Intervals: Sunpower {sunpower_update_invertal} Sunvault {sunvault_update_invertal}",
+    governor = hass.data[DOMAIN][SUNPOWER_GOVERNORS].setdefault(
+        entry.data[SUNPOWER_HOST],
+        PVSGovernor(requests_per_hour),
     )
-    _LOGGER.debug(f"Coordinator update interval set to {coordinator_interval}")
+    governor.requests_per_hour = requests_per_hour
 
-    coordinator = DataUpdateCoordinator(
+    # All poll state lives in this per-entry object so several PVSs never share caches
+    poller = SunPowerPoller(
         hass,
-        _LOGGER,
-        name="SunPower PVS",
-        update_method=async_update_data,
-        update_interval=timedelta(seconds=coordinator_interval),
+        entry_id,
+        entry.data[SUNPOWER_HOST],
+        poll_limiter=hass.data[DOMAIN][SUNPOWER_POLL_LIMITER],
+        governor=governor,
+        **options,
     )
+    # Closing the poller on unload aborts any poll still in flight
+    entry.async_on_unload(poller.async_close)
+    # Data persisted by the last run lets entities load without waiting on the PVS
+    await poller.async_setup(entry)
 
     hass.data[DOMAIN][entry.entry_id] = {
-        SUNPOWER_OBJECT: sunpower_monitor,
-        SUNPOWER_COORDINATOR: coordinator,
+        SUNPOWER_POLLER: poller,
+        SUNPOWER_OBJECT: poller.monitor,
+        SUNPOWER_GOVERNOR: governor,
+        SUNPOWER_COORDINATOR: poller.pvs_coordinator,
+        SUNVAULT_COORDINATOR: poller.ess_coordinator,
+        SUNPOWER_ENTRY_CONFIG: entry_config(entry),
     }
 
-    start = time.time()
-    # Need to make sure this data loads on setup, be aggressive about retries
-    while not coordinator.data:
-        _LOGGER.debug("Config Update Attempt")
-        await coordinator.async_refresh()
-        if (time.time() - start) > (SETUP_TIMEOUT_MIN * 60):
-            _LOGGER.error("Failed to update data")
-            break
-
     await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
 
     entry.async_on_unload(entry.add_update_listener(update_listener))
@@ -393,6 +156,46 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry):
     return True
 
 
+def poll_options(entry: ConfigEntry):
+    """The entry's options, with defaults, as SunPowerPoller keyword arguments"""
+    return {
+        "pvs_interval": entry.options.get(
+            SUNPOWER_UPDATE_INTERVAL,
+            DEFAULT_SUNPOWER_UPDATE_INTERVAL,
+        ),
+        "ess_interval": entry.options.get(
+            SUNVAULT_UPDATE_INTERVAL,
+            DEFAULT_SUNVAULT_UPDATE_INTERVAL,
+        ),
+        "grace_period": entry.options.get(STALE_GRACE_PERIOD, DEFAULT_STALE_GRACE_PERIOD),
+        "adaptive_timeout": entry.options.get(ADAPTIVE_TIMEOUT, DEFAULT_ADAPTIVE_TIMEOUT),
+        "night_interval": entry.options.get(
+            NIGHT_UPDATE_INTERVAL,
+            DEFAULT_NIGHT_UPDATE_INTERVAL,
+        ),
+        "retire_days": entry.options.get(RETIRE_DEVICE_DAYS, DEFAULT_RETIRE_DEVICE_DAYS),
+    }
+
+
+def entry_config(entry: ConfigEntry):
+    """What the running entry was set up or last updated with"""
+    return (dict(entry.data), dict(entry.options))
+
+
+def needs_reload(entry: ConfigEntry, applied):
+    """Only changed data (host, naming) or an option not in LIVE_OPTIONS changes the
+    entities, anything else is applied to the running poller"""
+    data, options = applied
+    if dict(entry.data) != data:
+        return True
+    changed = {
+        key
+        for key in options.keys() | entry.options.keys()
+        if options.get(key) != entry.options.get(key)
+    }
+    return not changed <= LIVE_OPTIONS
+
+
 async def update_listener(hass: HomeAssistant, entry: ConfigEntry) -> None:
     """Update listener."""
     _LOGGER.debug(
@@ -401,9 +204,19 @@ async def update_listener(hass: HomeAssistant, entry: ConfigEntry) -> None:
         entry.data,
         entry.options,
     )
-    _LOGGER.debug("Update listener called, reloading")
-    await hass.config_entries.async_reload(entry.entry_id)
-    _LOGGER.debug("Update listener done reloading")
+    entry_data = hass.data[DOMAIN].get(entry.entry_id)
+    if not entry_data or needs_reload(entry, entry_data[SUNPOWER_ENTRY_CONFIG]):
+        _LOGGER.debug("Update listener called, reloading")
+        await hass.config_entries.async_reload(entry.entry_id)
+        _LOGGER.debug("Update listener done reloading")
+        return
+    _LOGGER.debug("Update listener called, applying options")
+    entry_data[SUNPOWER_GOVERNOR].requests_per_hour = entry.options.get(
+        REQUESTS_PER_HOUR,
+        DEFAULT_REQUESTS_PER_HOUR,
+    )
+    entry_data[SUNPOWER_POLLER].async_apply_options(**poll_options(entry))
+    entry_data[SUNPOWER_ENTRY_CONFIG] = entry_config(entry)
 
 
 async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry):
@@ -414,3 +227,8 @@ async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry):
         hass.data[DOMAIN].pop(entry.entry_id)
 
     return unload_ok
+
+
+async def async_remove_entry(hass: HomeAssistant, entry: ConfigEntry):
+    """Drop the persisted samples of a removed config entry."""
+    await snapshot_store(hass, entry.entry_id).async_remove()
@@ -4,17 +4,15 @@ import logging
 
 from homeassistant.components.binary_sensor import BinarySensorEntity
 
-from .const import (
-    DOMAIN,
-    ESS_DEVICE_TYPE,
-    PVS_DEVICE_TYPE,
-    SUNPOWER_BINARY_SENSORS,
-    SUNPOWER_COORDINATOR,
-    SUNPOWER_DESCRIPTIVE_NAMES,
-    SUNPOWER_PRODUCT_NAMES,
-    SUNVAULT_BINARY_SENSORS,
+from .const import DOMAIN
+from .descriptors import (
+    BINARY_SENSOR_DESCRIPTIONS,
+    SUNVAULT_BINARY_SENSOR_DESCRIPTIONS,
+)
+from .entity import (
+    DeviceEntities,
+    SunPowerEntity,
 )
-from .entity import SunPowerEntity
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -24,104 +22,22 @@ async def async_setup_entry(hass, config_entry, async_add_entities):
     sunpower_state = hass.data[DOMAIN][config_entry.entry_id]
     _LOGGER.debug("Sunpower_state: %s", sunpower_state)
 
-    do_descriptive_names = False
-    if SUNPOWER_DESCRIPTIVE_NAMES in config_entry.data:
-        do_descriptive_names = config_entry.data[SUNPOWER_DESCRIPTIVE_NAMES]
-
-    do_product_names = False
-    if SUNPOWER_PRODUCT_NAMES in config_entry.data:
-        do_product_names = config_entry.data[SUNPOWER_PRODUCT_NAMES]
-
-    coordinator = sunpower_state[SUNPOWER_COORDINATOR]
-    sunpower_data = coordinator.data
-
-    do_ess = False
-    if ESS_DEVICE_TYPE in sunpower_data:
-        do_ess = True
-    else:
-        _LOGGER.debug("Found No ESS Data")
-
-    if PVS_DEVICE_TYPE not in sunpower_data:
-        _LOGGER.error("Cannot find PVS Entry")
-    else:
-        entities = []
-
-        pvs = next(iter(sunpower_data[PVS_DEVICE_TYPE].values()))
-
-        BINARY_SENSORS = SUNPOWER_BINARY_SENSORS
-        if do_ess:
-            BINARY_SENSORS.update(SUNVAULT_BINARY_SENSORS)
-
-        for device_type in BINARY_SENSORS:
-            if device_type not in sunpower_data:
-                _LOGGER.error(f"Cannot find any {device_type}")
-                continue
-            unique_id = BINARY_SENSORS[device_type]["unique_id"]
-            sensors = BINARY_SENSORS[device_type]["sensors"]
-            for index, sensor_data in enumerate(sunpower_data[device_type].values()):
-                for sensor_name in sensors:
-                    sensor = sensors[sensor_name]
-                    sensor_type = (
-                        "" if not do_descriptive_names else f"{sensor_data.get('TYPE', '')} "
-                    )
-                    sensor_description = (
-                        "" if not do_descriptive_names else f"{sensor_data.get('DESCR', '')} "
-                    )
-                    text_sunpower = "" if not do_product_names else "SunPower "
-                    text_sunvault = "" if not do_product_names else "SunVault "
-                    text_pvs = "" if not do_product_names else "PVS "
-                    sensor_index = "" if not do_descriptive_names else f"{index + 1} "
-                    sunpower_sensor = SunPowerState(
-                        coordinator=coordinator,
-                        my_info=sensor_data,
-                        parent_info=pvs if device_type != PVS_DEVICE_TYPE else None,
-                        id_code=unique_id,
-                        device_type=device_type,
-                        field=sensor["field"],
-                        title=sensor["title"].format(
-                            index=sensor_index,
-                            TYPE=sensor_type,
-                            DESCR=sensor_description,
-                            SUN_POWER=text_sunpower,
-                            SUN_VAULT=text_sunvault,
-                            PVS=text_pvs,
-                            SERIAL=sensor_data.get("SERIAL", "Unknown"),
-                            MODEL=sensor_data.get("MODEL", "Unknown"),
-                        ),
-                        device_class=sensor["device"],
-                        on_value=sensor["on_value"],
-                        entity_category=sensor.get("entity_category", None),
-                    )
-                    entities.append(sunpower_sensor)
-
-    async_add_entities(entities, True)
+    device_entities = DeviceEntities(
+        sunpower_state,
+        config_entry,
+        BINARY_SENSOR_DESCRIPTIONS,
+        SUNVAULT_BINARY_SENSOR_DESCRIPTIONS,
+        SunPowerState,
+    )
+    entities = device_entities.new_entities(log_missing=True)
+
+    async_add_entities(entities)
+    device_entities.async_track(async_add_entities)
 
 
 class SunPowerState(SunPowerEntity, BinarySensorEntity):
     """Representation of SunPower Meter Working State"""
 
-    def __init__(
-        self,
-        coordinator,
-        my_info,
-        parent_info,
-        id_code,
-        device_type,
-        field,
-        title,
-        device_class,
-        on_value,
-        entity_category,
-    ):
-        super().__init__(coordinator, my_info, parent_info)
-        self._id_code = id_code
-        self._device_type = device_type
-        self._title = title
-        self._field = field
-        self._my_device_class = device_class
-        self._on_value = on_value
-        self._entity_category = entity_category
-
     @property
     def name(self):
         """Device Name."""
@@ -130,11 +46,11 @@ class SunPowerState(SunPowerEntity, BinarySensorEntity):
     @property
     def device_class(self):
         """Device Class."""
-        return self._my_device_class
+        return self._description.device_class
 
     @property
     def entity_category(self):
-        return self._entity_category
+        return self._description.entity_category
 
     @property
     def unique_id(self):
@@ -157,4 +73,4 @@ class SunPowerState(SunPowerEntity, BinarySensorEntity):
     @property
     def is_on(self):
         """Return true if the binary sensor is on."""
-        return self.state == self._on_value
+        return self.state == self._description.on_value
@@ -9,22 +9,36 @@ from homeassistant import (
     exceptions,
 )
 from homeassistant.const import CONF_HOST
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
 
 from .const import (
+    ADAPTIVE_TIMEOUT,
+    DEFAULT_ADAPTIVE_TIMEOUT,
+    DEFAULT_NIGHT_UPDATE_INTERVAL,
+    DEFAULT_RETIRE_DEVICE_DAYS,
+    DEFAULT_STALE_GRACE_PERIOD,
     DEFAULT_SUNPOWER_UPDATE_INTERVAL,
     DEFAULT_SUNVAULT_UPDATE_INTERVAL,
     DOMAIN,
+    MIN_REQUESTS_PER_HOUR,
     MIN_SUNPOWER_UPDATE_INTERVAL,
     MIN_SUNVAULT_UPDATE_INTERVAL,
+    NIGHT_UPDATE_INTERVAL,
+    REQUESTS_PER_HOUR,
+    RETIRE_DEVICE_DAYS,
+    STALE_GRACE_PERIOD,
     SUNPOWER_DESCRIPTIVE_NAMES,
+    SUNPOWER_GOVERNORS,
     SUNPOWER_HOST,
+    SUNPOWER_OBJECT,
     SUNPOWER_PRODUCT_NAMES,
     SUNPOWER_UPDATE_INTERVAL,
     SUNVAULT_UPDATE_INTERVAL,
 )
 from .sunpower import (
+    DEFAULT_REQUESTS_PER_HOUR,
+    AsyncSunPowerMonitor,
     ConnectionException,
-    SunPowerMonitor,
 )
 
 _LOGGER = logging.getLogger(__name__)
@@ -38,16 +52,29 @@ DATA_SCHEMA = vol.Schema(
 )
 
 
+def running_monitor(hass: core.HomeAssistant, host):
+    """The monitor of an entry already polling this host, so requests are coalesced with its"""
+    for entry_state in hass.data.get(DOMAIN, {}).values():
+        monitor = entry_state.get(SUNPOWER_OBJECT) if isinstance(entry_state, dict) else None
+        if monitor is not None and monitor.host == host:
+            return monitor
+    return None
+
+
 async def validate_input(hass: core.HomeAssistant, data):
     """Validate the user input allows us to connect.
 
     Data has the keys from DATA_SCHEMA with values provided by the user.
     """
 
-    spm = SunPowerMonitor(data[SUNPOWER_HOST])
+    spm = running_monitor(hass, data[SUNPOWER_HOST]) or AsyncSunPowerMonitor(
+        data[SUNPOWER_HOST],
+        session=async_get_clientsession(hass),
+        governor=hass.data.get(DOMAIN, {}).get(SUNPOWER_GOVERNORS, {}).get(data[SUNPOWER_HOST]),
+    )
     name = "PVS {}".format(data[SUNPOWER_HOST])
     try:
-        response = await hass.async_add_executor_job(spm.network_status)
+        response = await spm.network_status()
         _LOGGER.debug("Got from %s %s", data[SUNPOWER_HOST], response)
     except ConnectionException as error:
         raise CannotConnect from error
@@ -117,9 +144,23 @@ class OptionsFlowHandler(config_entries.OptionsFlow):
                 errors[SUNPOWER_UPDATE_INTERVAL] = "MIN_INTERVAL"
             if user_input[SUNVAULT_UPDATE_INTERVAL] < MIN_SUNVAULT_UPDATE_INTERVAL:
                 errors[SUNPOWER_UPDATE_INTERVAL] = "MIN_INTERVAL"
+            night_interval = user_input[NIGHT_UPDATE_INTERVAL]
+            if night_interval != 0 and night_interval < MIN_SUNPOWER_UPDATE_INTERVAL:
+                errors[NIGHT_UPDATE_INTERVAL] = "MIN_INTERVAL"
+            if user_input[STALE_GRACE_PERIOD] < 0:
+                errors[STALE_GRACE_PERIOD] = "NEGATIVE_GRACE"
+            if user_input[REQUESTS_PER_HOUR] < MIN_REQUESTS_PER_HOUR:
+                errors[REQUESTS_PER_HOUR] = "MIN_BUDGET"
+            if user_input[RETIRE_DEVICE_DAYS] < 0:
+                errors[RETIRE_DEVICE_DAYS] = "NEGATIVE_RETIRE"
             if len(errors) == 0:
                 options[SUNPOWER_UPDATE_INTERVAL] = user_input[SUNPOWER_UPDATE_INTERVAL]
                 options[SUNVAULT_UPDATE_INTERVAL] = user_input[SUNVAULT_UPDATE_INTERVAL]
+                options[STALE_GRACE_PERIOD] = user_input[STALE_GRACE_PERIOD]
+                options[ADAPTIVE_TIMEOUT] = user_input[ADAPTIVE_TIMEOUT]
+                options[REQUESTS_PER_HOUR] = user_input[REQUESTS_PER_HOUR]
+                options[NIGHT_UPDATE_INTERVAL] = user_input[NIGHT_UPDATE_INTERVAL]
+                options[RETIRE_DEVICE_DAYS] = user_input[RETIRE_DEVICE_DAYS]
                 return self.async_create_entry(title="", data=user_input)
 
         current_sunpower_interval = options.get(
@@ -130,6 +171,11 @@ class OptionsFlowHandler(config_entries.OptionsFlow):
             SUNVAULT_UPDATE_INTERVAL,
             DEFAULT_SUNVAULT_UPDATE_INTERVAL,
         )
+        current_grace_period = options.get(STALE_GRACE_PERIOD, DEFAULT_STALE_GRACE_PERIOD)
+        current_adaptive_timeout = options.get(ADAPTIVE_TIMEOUT, DEFAULT_ADAPTIVE_TIMEOUT)
+        current_requests_per_hour = options.get(REQUESTS_PER_HOUR, DEFAULT_REQUESTS_PER_HOUR)
+        current_night_interval = options.get(NIGHT_UPDATE_INTERVAL, DEFAULT_NIGHT_UPDATE_INTERVAL)
+        current_retire_days = options.get(RETIRE_DEVICE_DAYS, DEFAULT_RETIRE_DEVICE_DAYS)
 
         return self.async_show_form(
             step_id="init",
@@ -137,6 +183,11 @@ class OptionsFlowHandler(config_entries.OptionsFlow):
                 {
                     vol.Required(SUNPOWER_UPDATE_INTERVAL, default=current_sunpower_interval): int,
                     vol.Required(SUNVAULT_UPDATE_INTERVAL, default=current_sunvault_interval): int,
+                    vol.Required(STALE_GRACE_PERIOD, default=current_grace_period): int,
+                    vol.Required(ADAPTIVE_TIMEOUT, default=current_adaptive_timeout): bool,
+                    vol.Required(REQUESTS_PER_HOUR, default=current_requests_per_hour): int,
+                    vol.Required(NIGHT_UPDATE_INTERVAL, default=current_night_interval): int,
+                    vol.Required(RETIRE_DEVICE_DAYS, default=current_retire_days): int,
                 },
             ),
             errors=errors,
@@ -19,6 +19,11 @@ from homeassistant.const import (
     UnitOfTime,
 )
 
+from .sunpower import (
+    DEVICE_LIST,
+    ESS_STATUS,
+)
+
 DOMAIN = "sunpower"
 
 SUNPOWER_DESCRIPTIVE_NAMES = "use_descriptive_names"
@@ -26,13 +31,62 @@ SUNPOWER_PRODUCT_NAMES = "use_product_names"
 SUNPOWER_OBJECT = "sunpower"
 SUNPOWER_HOST = "host"
 SUNPOWER_COORDINATOR = "coordinator"
+SUNVAULT_COORDINATOR = "sunvault_coordinator"
+SUNPOWER_POLLER = "poller"
+SUNPOWER_ENTRY_CONFIG = "entry_config"
+SUNPOWER_POLL_LIMITER = "poll_limiter"
+SUNPOWER_GOVERNOR = "governor"
+SUNPOWER_GOVERNORS = "governors"
+SUNPOWER_MAX_CONCURRENT_POLLS = "max_concurrent_polls"
+DEFAULT_MAX_CONCURRENT_POLLS = 4
 DEFAULT_SUNPOWER_UPDATE_INTERVAL = 120
 DEFAULT_SUNVAULT_UPDATE_INTERVAL = 60
 MIN_SUNPOWER_UPDATE_INTERVAL = 60
 MIN_SUNVAULT_UPDATE_INTERVAL = 20
 SUNPOWER_UPDATE_INTERVAL = "PVS_UPDATE_INTERVAL"
 SUNVAULT_UPDATE_INTERVAL = "ESS_UPDATE_INTERVAL"
-SETUP_TIMEOUT_MIN = 5
+STALE_GRACE_PERIOD = "STALE_GRACE_PERIOD"
+DEFAULT_STALE_GRACE_PERIOD = 0
+ADAPTIVE_TIMEOUT = "ADAPTIVE_TIMEOUT"
+DEFAULT_ADAPTIVE_TIMEOUT = False
+REQUESTS_PER_HOUR = "REQUESTS_PER_HOUR"
+MIN_REQUESTS_PER_HOUR = 30
+RETIRE_DEVICE_DAYS = "RETIRE_DEVICE_DAYS"
+DEFAULT_RETIRE_DEVICE_DAYS = 0
+NIGHT_UPDATE_INTERVAL = "NIGHT_UPDATE_INTERVAL"
+DEFAULT_NIGHT_UPDATE_INTERVAL = 0
+# With a night interval the PVS is polled at it while the sun is below the horizon, and
+# while every inverter reports zero production with the sun above DAYLIGHT_ELEVATION
+# (degrees), lower than that no production is expected anyway at dawn and dusk
+DAYLIGHT_ELEVATION = 10
+SOURCE_JITTER_FRACTION = 0.05
+SOURCE_MAX_BACKOFF = 8
+# Poll intervals stretch (up to LOAD_MAX_FACTOR times) while the PVS health counters say it
+# is struggling: system load above LOAD_HIGH_CPU, skipped scans going up, untransmitted data
+# growing or flash shrinking for LOAD_TREND_MEASUREMENTS measurements in a row, or flash
+# below LOAD_MIN_FLASH (KB).  They relax back while load is below LOAD_LOW_CPU and all is well
+LOAD_HIGH_CPU = 1.5
+LOAD_LOW_CPU = 0.75
+LOAD_MIN_FLASH = 20000
+LOAD_TREND_MEASUREMENTS = 3
+LOAD_STRETCH = 1.5
+LOAD_RELAX = 0.8
+LOAD_MAX_FACTOR = 4
+# Inverter DATATIME advances once per PVS scan, the scan period is learnt from the smallest of
+# the last PHASE_WINDOW advances (at least PHASE_MIN_PERIOD seconds, after PHASE_MIN_ADVANCES
+# of them) and DeviceList is then polled PHASE_LAG seconds after each expected scan
+PHASE_WINDOW = 10
+PHASE_MIN_ADVANCES = 3
+PHASE_MIN_PERIOD = 30
+PHASE_LAG = 15
+STORAGE_VERSION = 1
+SNAPSHOT_SAVE_DELAY = 60
+PVS_SAMPLE = "device_list"
+ESS_SAMPLE = "ess_status"
+# Saved with the samples so the days until a device is retired count across restarts
+MISSING_DEVICES = "missing_devices"
+# When each sample was fetched, so the stale grace period also covers restored samples
+SAMPLE_FETCHED = "fetched"
 
 PVS_DEVICE_TYPE = "PVS"
 INVERTER_DEVICE_TYPE = "Inverter"
@@ -44,6 +98,53 @@ SUNVAULT_DEVICE_TYPE = "SunVault"
 
 WORKING_STATE = "working"
 
+# Where each ESS field lives in the energy-storage-system/status report.
+# device type -> (ess_report section, {field: path within each device in that section})
+# convert.py compiles the paths once into accessors, a new ESS field is just a new entry.
+SUNVAULT_ESS_FIELDS = {
+    BATTERY_DEVICE_TYPE: (
+        "battery_status",
+        {
+            "battery_amperage": ("battery_amperage", "value"),
+            "battery_voltage": ("battery_voltage", "value"),
+            "customer_state_of_charge": ("customer_state_of_charge", "value"),
+            "system_state_of_charge": ("system_state_of_charge", "value"),
+            "temperature": ("temperature", "value"),
+        },
+    ),
+    ESS_DEVICE_TYPE: (
+        "ess_status",
+        {
+            "enclosure_humidity": ("enclosure_humidity", "value"),
+            "enclosure_temperature": ("enclosure_temperature", "value"),
+            "agg_power": ("ess_meter_reading", "agg_power", "value"),
+            "meter_a_current": ("ess_meter_reading", "meter_a", "reading", "current", "value"),
+            "meter_a_power": ("ess_meter_reading", "meter_a", "reading", "power", "value"),
+            "meter_a_voltage": ("ess_meter_reading", "meter_a", "reading", "voltage", "value"),
+            "meter_b_current": ("ess_meter_reading", "meter_b", "reading", "current", "value"),
+            "meter_b_power": ("ess_meter_reading", "meter_b", "reading", "power", "value"),
+            "meter_b_voltage": ("ess_meter_reading", "meter_b", "reading", "voltage", "value"),
+        },
+    ),
+    HUBPLUS_DEVICE_TYPE: (
+        "hub_plus_status",
+        {
+            "contactor_position": ("contactor_position",),
+            "grid_frequency_state": ("grid_frequency_state",),
+            "grid_phase1_voltage": ("grid_phase1_voltage", "value"),
+            "grid_phase2_voltage": ("grid_phase2_voltage", "value"),
+            "grid_voltage_state": ("grid_voltage_state",),
+            "hub_humidity": ("hub_humidity", "value"),
+            "hub_temperature": ("hub_temperature", "value"),
+            "inverter_connection_voltage": ("inverter_connection_voltage", "value"),
+            "load_frequency_state": ("load_frequency_state",),
+            "load_phase1_voltage": ("load_phase1_voltage", "value"),
+            "load_phase2_voltage": ("load_phase2_voltage", "value"),
+            "main_voltage": ("main_voltage", "value"),
+        },
+    ),
+}
+
 # SUNPOWER_DESCRIPTIVE_NAMES will take advantage of the following:
 # - {SUN_POWER} is replaced with "SunPower "
 # - {TYPE} is replaced with "{data['TYPE']} " if available otherwise ""
@@ -223,6 +324,15 @@ SUNPOWER_SENSORS = {
                 "state": SensorStateClass.MEASUREMENT,
                 "entity_category": EntityCategory.DIAGNOSTIC,
             },
+            "PVS_LAST_MEASUREMENT": {
+                "field": "DATATIME",
+                "title": "{SUN_POWER}{MODEL} {SERIAL} Last Measurement",
+                "unit": None,
+                "icon": "mdi:clock-outline",
+                "device": SensorDeviceClass.TIMESTAMP,
+                "state": None,
+                "entity_category": EntityCategory.DIAGNOSTIC,
+            },
         },
     },
     METER_DEVICE_TYPE: {
@@ -366,6 +476,15 @@ SUNPOWER_SENSORS = {
                 "device": SensorDeviceClass.ENERGY,
                 "state": SensorStateClass.TOTAL_INCREASING,
             },
+            "METER_LAST_MEASUREMENT": {
+                "field": "DATATIME",
+                "title": "{SUN_POWER}{DESCR}Last Measurement",
+                "unit": None,
+                "icon": "mdi:clock-outline",
+                "device": SensorDeviceClass.TIMESTAMP,
+                "state": None,
+                "entity_category": EntityCategory.DIAGNOSTIC,
+            },
         },
     },
     INVERTER_DEVICE_TYPE: {
@@ -459,6 +578,15 @@ SUNPOWER_SENSORS = {
                 "state": SensorStateClass.MEASUREMENT,
                 "entity_category": EntityCategory.DIAGNOSTIC,
             },
+            "INVERTER_LAST_MEASUREMENT": {
+                "field": "DATATIME",
+                "title": "{SUN_POWER}{DESCR}Last Measurement",
+                "unit": None,
+                "icon": "mdi:clock-outline",
+                "device": SensorDeviceClass.TIMESTAMP,
+                "state": None,
+                "entity_category": EntityCategory.DIAGNOSTIC,
+            },
         },
     },
 }
@@ -777,3 +905,168 @@ SUNVAULT_SENSORS = {
         },
     },
 }
+
+# Diagnostics about polling a data source rather than fields the PVS reports, all of them on
+# the PVS device.  'coordinator' is the data source they describe and update with, 'attribute'
+# is read from 'source' (that coordinator when not given) and called with 'args' if given
+SUNPOWER_POLL_SENSORS = {
+    "PVS_LAST_SUCCESS": {
+        "coordinator": SUNPOWER_COORDINATOR,
+        "attribute": "last_success",
+        "title": "{SUN_POWER}{MODEL} {SERIAL} Last Successful Poll",
+        "unit": None,
+        "icon": "mdi:clock-check-outline",
+        "device": SensorDeviceClass.TIMESTAMP,
+        "state": None,
+        "entity_category": EntityCategory.DIAGNOSTIC,
+    },
+    "ESS_LAST_SUCCESS": {
+        "coordinator": SUNVAULT_COORDINATOR,
+        "attribute": "last_success",
+        "title": "{SUN_POWER}{MODEL} {SERIAL} ESS Last Successful Poll",
+        "unit": None,
+        "icon": "mdi:clock-check-outline",
+        "device": SensorDeviceClass.TIMESTAMP,
+        "state": None,
+        "entity_category": EntityCategory.DIAGNOSTIC,
+    },
+    "PVS_LOAD_FACTOR": {
+        "coordinator": SUNPOWER_COORDINATOR,
+        "attribute": "load_factor",
+        "title": "{SUN_POWER}{MODEL} {SERIAL} Poll Interval Factor",
+        "unit": None,
+        "icon": "mdi:speedometer-slow",
+        "device": None,
+        "state": SensorStateClass.MEASUREMENT,
+        "entity_category": EntityCategory.DIAGNOSTIC,
+    },
+    "GOVERNOR_STATE": {
+        "coordinator": SUNPOWER_COORDINATOR,
+        "source": SUNPOWER_GOVERNOR,
+        "attribute": "state",
+        "title": "{SUN_POWER}{MODEL} {SERIAL} Governor State",
+        "unit": None,
+        "icon": "mdi:shield-half-full",
+        "device": None,
+        "state": None,
+        "entity_category": EntityCategory.DIAGNOSTIC,
+    },
+    "GOVERNOR_REMAINING": {
+        "coordinator": SUNPOWER_COORDINATOR,
+        "source": SUNPOWER_GOVERNOR,
+        "attribute": "remaining",
+        "title": "{SUN_POWER}{MODEL} {SERIAL} Request Budget",
+        "unit": None,
+        "icon": "mdi:gauge",
+        "device": None,
+        "state": SensorStateClass.MEASUREMENT,
+        "entity_category": EntityCategory.DIAGNOSTIC,
+    },
+    "GOVERNOR_REFUSED": {
+        "coordinator": SUNPOWER_COORDINATOR,
+        "source": SUNPOWER_GOVERNOR,
+        "attribute": "refused",
+        "title": "{SUN_POWER}{MODEL} {SERIAL} Refused Requests",
+        "unit": None,
+        "icon": "mdi:shield-alert-outline",
+        "device": None,
+        "state": SensorStateClass.TOTAL_INCREASING,
+        "entity_category": EntityCategory.DIAGNOSTIC,
+    },
+    "PVS_LATENCY_P50": {
+        "coordinator": SUNPOWER_COORDINATOR,
+        "source": SUNPOWER_OBJECT,
+        "attribute": "latency",
+        "args": (DEVICE_LIST, 50),
+        "title": "{SUN_POWER}{MODEL} {SERIAL} DeviceList Latency p50",
+        "unit": UnitOfTime.SECONDS,
+        "icon": "mdi:timer-outline",
+        "device": SensorDeviceClass.DURATION,
+        "state": SensorStateClass.MEASUREMENT,
+        "entity_category": EntityCategory.DIAGNOSTIC,
+    },
+    "PVS_LATENCY_P95": {
+        "coordinator": SUNPOWER_COORDINATOR,
+        "source": SUNPOWER_OBJECT,
+        "attribute": "latency",
+        "args": (DEVICE_LIST, 95),
+        "title": "{SUN_POWER}{MODEL} {SERIAL} DeviceList Latency p95",
+        "unit": UnitOfTime.SECONDS,
+        "icon": "mdi:timer-outline",
+        "device": SensorDeviceClass.DURATION,
+        "state": SensorStateClass.MEASUREMENT,
+        "entity_category": EntityCategory.DIAGNOSTIC,
+    },
+    "PVS_LATENCY_P99": {
+        "coordinator": SUNPOWER_COORDINATOR,
+        "source": SUNPOWER_OBJECT,
+        "attribute": "latency",
+        "args": (DEVICE_LIST, 99),
+        "title": "{SUN_POWER}{MODEL} {SERIAL} DeviceList Latency p99",
+        "unit": UnitOfTime.SECONDS,
+        "icon": "mdi:timer-outline",
+        "device": SensorDeviceClass.DURATION,
+        "state": SensorStateClass.MEASUREMENT,
+        "entity_category": EntityCategory.DIAGNOSTIC,
+    },
+    "PVS_TIMEOUTS": {
+        "coordinator": SUNPOWER_COORDINATOR,
+        "source": SUNPOWER_OBJECT,
+        "attribute": "timeouts",
+        "args": (DEVICE_LIST,),
+        "title": "{SUN_POWER}{MODEL} {SERIAL} DeviceList Timeouts",
+        "unit": None,
+        "icon": "mdi:timer-alert-outline",
+        "device": None,
+        "state": SensorStateClass.TOTAL_INCREASING,
+        "entity_category": EntityCategory.DIAGNOSTIC,
+    },
+    "ESS_LATENCY_P50": {
+        "coordinator": SUNVAULT_COORDINATOR,
+        "source": SUNPOWER_OBJECT,
+        "attribute": "latency",
+        "args": (ESS_STATUS, 50),
+        "title": "{SUN_POWER}{MODEL} {SERIAL} ESS Latency p50",
+        "unit": UnitOfTime.SECONDS,
+        "icon": "mdi:timer-outline",
+        "device": SensorDeviceClass.DURATION,
+        "state": SensorStateClass.MEASUREMENT,
+        "entity_category": EntityCategory.DIAGNOSTIC,
+    },
+    "ESS_LATENCY_P95": {
+        "coordinator": SUNVAULT_COORDINATOR,
+        "source": SUNPOWER_OBJECT,
+        "attribute": "latency",
+        "args": (ESS_STATUS, 95),
+        "title": "{SUN_POWER}{MODEL} {SERIAL} ESS Latency p95",
+        "unit": UnitOfTime.SECONDS,
+        "icon": "mdi:timer-outline",
+        "device": SensorDeviceClass.DURATION,
+        "state": SensorStateClass.MEASUREMENT,
+        "entity_category": EntityCategory.DIAGNOSTIC,
+    },
+    "ESS_LATENCY_P99": {
+        "coordinator": SUNVAULT_COORDINATOR,
+        "source": SUNPOWER_OBJECT,
+        "attribute": "latency",
+        "args": (ESS_STATUS, 99),
+        "title": "{SUN_POWER}{MODEL} {SERIAL} ESS Latency p99",
+        "unit": UnitOfTime.SECONDS,
+        "icon": "mdi:timer-outline",
+        "device": SensorDeviceClass.DURATION,
+        "state": SensorStateClass.MEASUREMENT,
+        "entity_category": EntityCategory.DIAGNOSTIC,
+    },
+    "ESS_TIMEOUTS": {
+        "coordinator": SUNVAULT_COORDINATOR,
+        "source": SUNPOWER_OBJECT,
+        "attribute": "timeouts",
+        "args": (ESS_STATUS,),
+        "title": "{SUN_POWER}{MODEL} {SERIAL} ESS Timeouts",
+        "unit": None,
+        "icon": "mdi:timer-alert-outline",
+        "device": None,
+        "state": SensorStateClass.TOTAL_INCREASING,
+        "entity_category": EntityCategory.DIAGNOSTIC,
+    },
+}
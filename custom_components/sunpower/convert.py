@@ -0,0 +1,452 @@
+"""Convert PVS and ESS responses into the data[device_type][serial] structure."""
+
+import sys
+from collections.abc import Mapping
+from datetime import (
+    datetime,
+    timezone,
+)
+from operator import itemgetter
+from types import MappingProxyType
+
+from homeassistant.components.sensor import SensorDeviceClass
+
+from .const import (
+    BATTERY_DEVICE_TYPE,
+    INVERTER_DEVICE_TYPE,
+    METER_DEVICE_TYPE,
+    PVS_DEVICE_TYPE,
+    SUNPOWER_BINARY_SENSORS,
+    SUNPOWER_SENSORS,
+    SUNVAULT_BINARY_SENSORS,
+    SUNVAULT_DEVICE_TYPE,
+    SUNVAULT_ESS_FIELDS,
+    SUNVAULT_SENSORS,
+)
+
+# DeviceList sends every number and time as a string, these are the fields our sensors read
+# as timestamps, every other sensor field is a number
+TIMESTAMP_FIELDS = frozenset(
+    sensor["field"]
+    for device_type in SUNPOWER_SENSORS.values()
+    for sensor in device_type["sensors"].values()
+    if sensor["device"] == SensorDeviceClass.TIMESTAMP
+)
+NUMERIC_FIELDS = frozenset(
+    sensor["field"]
+    for device_type in SUNPOWER_SENSORS.values()
+    for sensor in device_type["sensors"].values()
+    if sensor["field"] not in TIMESTAMP_FIELDS
+)
+# Text fields repeated in every poll, interned so records share one copy of each value
+INTERNED_FIELDS = frozenset(("SERIAL", "DEVICE_TYPE", "MODEL", "TYPE", "STATE"))
+
+
+def parse_number(value):
+    """Parse a PVS number, keeping whatever it sent (e.g. 'unavailable') if it is not one"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def parse_time(value):
+    """Parse a PVS time like DATATIME '2024,04,16,23,46,10', the PVS reports UTC"""
+    try:
+        return datetime.strptime(value, "%Y,%m,%d,%H,%M,%S").replace(tzinfo=timezone.utc)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_field(key, value):
+    """Parse one raw DeviceList field into the type its sensors expect"""
+    if key in NUMERIC_FIELDS:
+        return parse_number(value)
+    if key in TIMESTAMP_FIELDS:
+        return parse_time(value)
+    if key in INTERNED_FIELDS and isinstance(value, str):
+        return sys.intern(value)
+    return value
+
+
+class DeviceRecord(Mapping):
+    """One device from a poll with its numeric fields parsed once, when the record is built.
+    Reads like the dict it replaces (record["STATE"], record.get(...)) so entities only do a
+    lookup per state read, the common identity fields are also plain attributes.
+    Records are read only, so one can be shared by every snapshot it appears in."""
+
+    __slots__ = ("serial", "device_type", "model", "state", "datatime", "fields")
+
+    def __init__(self, fields, datatime=None):
+        """Initialize, fields is owned by the record from here on"""
+        set_slot = object.__setattr__
+        set_slot(self, "fields", MappingProxyType(fields))
+        set_slot(self, "serial", fields.get("SERIAL"))
+        set_slot(self, "device_type", fields.get("DEVICE_TYPE"))
+        set_slot(self, "model", fields.get("MODEL"))
+        set_slot(self, "state", fields.get("STATE"))
+        # DATATIME exactly as the PVS sent it, to spot a measurement that has not advanced
+        set_slot(self, "datatime", datatime)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"DeviceRecord is read only, cannot set {name}")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"DeviceRecord is read only, cannot delete {name}")
+
+    @classmethod
+    def from_pvs(cls, device):
+        """Build a record from a DeviceList device already projected by project_device"""
+        return cls(
+            {key: parse_field(key, value) for key, value in device.items()},
+            device.get("DATATIME"),
+        )
+
+    def same_measurement(self, device):
+        """Is this raw DeviceList device the same measurement this record was built from.
+        The PVS scans its devices slower than we may poll, so an unchanged DATATIME (and
+        state) means nothing in the device has changed either."""
+        if self.datatime is None:
+            return False
+        return (self.datatime, self.state) == (device.get("DATATIME"), device.get("STATE"))
+
+    @property
+    def measured_at(self):
+        """When the PVS took this measurement, None if it did not say"""
+        return self.fields.get("DATATIME")
+
+    def __getitem__(self, key):
+        return self.fields[key]
+
+    def __iter__(self):
+        return iter(self.fields)
+
+    def __len__(self):
+        return len(self.fields)
+
+    def __contains__(self, key):
+        return key in self.fields
+
+    def get(self, key, default=None):
+        return self.fields.get(key, default)
+
+    def __repr__(self):
+        return f"DeviceRecord({self.fields!r})"
+
+
+# Inverter fields the virtual meter is built from
+VMETER_FIELDS = ("ltea_3phsum_kwh", "p_mppt1_kw", "i_3phsum_a", "freq_hz", "vln_3phavg_v")
+
+
+# The DeviceList fields anything reads: every (binary) sensor field, what names and identifies
+# a device, the virtual meter columns and the measurement and PVS clock times.  The rest of
+# what the PVS sends (CAL0, PORT, OPERATION, origin, ...) is dropped as devices are read.
+# Maps each name to one interned copy that every record uses as its key
+DEVICE_FIELDS = {
+    sys.intern(field): sys.intern(field)
+    for field in frozenset(
+        sensor["field"]
+        for descriptors in (
+            SUNPOWER_SENSORS,
+            SUNVAULT_SENSORS,
+            SUNPOWER_BINARY_SENSORS,
+            SUNVAULT_BINARY_SENSORS,
+        )
+        for device_type in descriptors.values()
+        for sensor in device_type["sensors"].values()
+    ).union(
+        INTERNED_FIELDS,
+        VMETER_FIELDS,
+        ("DESCR", "SWVER", "HWVER", "hw_version", "DATATIME", "CURTIME"),
+    )
+}
+
+
+def project_device(device):
+    """A raw DeviceList device with only its DEVICE_FIELDS, what is kept between polls"""
+    return {DEVICE_FIELDS[key]: value for key, value in device.items() if key in DEVICE_FIELDS}
+
+
+def create_vmeter(data):
+    # Create a virtual 'METER' that uses the sum of inverters
+    kwh = 0.0
+    kw = 0.0
+    amps = 0.0
+    freq = []
+    volts = []
+    state = "working"
+    # A field the inverter did not report, or reported as text like 'unavailable', is skipped
+    number = (int, float)
+    for inverter in data.get(INVERTER_DEVICE_TYPE, {}).values():
+        if inverter.state is not None and inverter.state != "working":
+            state = inverter.state
+        fields = inverter.fields
+        value = fields.get("ltea_3phsum_kwh")
+        if isinstance(value, number):
+            kwh += value
+        value = fields.get("p_mppt1_kw")
+        if isinstance(value, number):
+            kw += value
+        value = fields.get("i_3phsum_a")
+        if isinstance(value, number):
+            amps += value
+        value = fields.get("freq_hz")
+        if isinstance(value, number):
+            freq.append(value)
+        value = fields.get("vln_3phavg_v")
+        if isinstance(value, number):
+            volts.append(value)
+
+    freq_avg = sum(freq) / len(freq) if len(freq) > 0 else None
+    volts_avg = sum(volts) / len(volts) if len(volts) > 0 else None
+
+    pvs_serial = next(iter(data[PVS_DEVICE_TYPE]))  # only one PVS
+    vmeter_serial = f"{pvs_serial}pv"
+    data.setdefault(METER_DEVICE_TYPE, {})[vmeter_serial] = DeviceRecord(
+        {
+            "SERIAL": vmeter_serial,
+            "TYPE": "PVS-METER-P",
+            "STATE": state,
+            "MODEL": "Virtual",
+            "DESCR": f"Power Meter {vmeter_serial}",
+            "DEVICE_TYPE": "Power Meter",
+            "interface": "virtual",
+            "SWVER": "1.0",
+            "HWVER": "Virtual",
+            "origin": "virtual",
+            "net_ltea_3phsum_kwh": kwh,
+            "p_3phsum_kw": kw,
+            "freq_hz": freq_avg,
+            "i_a": amps,
+            "v12_v": volts_avg,
+        },
+    )
+    return data
+
+
+def reuse_vmeter(data, previous):
+    """Carry the previous virtual meter over when no inverter measurement advanced"""
+    pvs_serial = next(iter(data[PVS_DEVICE_TYPE]))  # only one PVS
+    vmeter_serial = f"{pvs_serial}pv"
+    vmeter = previous.get(METER_DEVICE_TYPE, {}).get(vmeter_serial)
+    if vmeter is None:
+        return False
+    data.setdefault(METER_DEVICE_TYPE, {})[vmeter_serial] = vmeter
+    return True
+
+
+class DeviceListConverter:
+    """Converts DeviceList devices one at a time, as they are decoded, into a read only
+    snapshot data[device_type][serial] of DeviceRecords.
+    Each raw device is projected to its DEVICE_FIELDS and dropped straight away, devices is
+    the projected DeviceList, what is persisted.  Devices whose measurement has not advanced
+    since previous keep their previous record, so they are neither parsed again nor reported
+    as changed."""
+
+    def __init__(self, previous=None):
+        """Initialize."""
+        self.previous = previous or {}
+        self.devices = []
+        self.data = {}
+        self.inverters_advanced = False
+        self.snapshot = None
+
+    def add(self, device):
+        """Take in the next raw DeviceList device"""
+        device = project_device(device)
+        self.devices.append(device)
+        device_type = device["DEVICE_TYPE"]
+        record = self.previous.get(device_type, {}).get(device["SERIAL"])
+        if record is None or not record.same_measurement(device):
+            record = DeviceRecord.from_pvs(device)
+            if device_type == INVERTER_DEVICE_TYPE:
+                self.inverters_advanced = True
+        # Indexed by the record's interned names rather than this poll's copies
+        self.data.setdefault(record.device_type, {})[record.serial] = record
+
+    def close(self):
+        """The snapshot once every device has been added, also kept as snapshot"""
+        data = self.data
+        previous = self.previous
+        # The virtual meter only moves when an inverter measurement does
+        inverters_changed = self.inverters_advanced
+        if len(data.get(INVERTER_DEVICE_TYPE, {})) != len(previous.get(INVERTER_DEVICE_TYPE, {})):
+            inverters_changed = True
+        if inverters_changed or not reuse_vmeter(data, previous):
+            create_vmeter(data)
+        self.snapshot = freeze(data, previous)
+        return self.snapshot
+
+
+def convert_sunpower_data(sunpower_data, previous=None):
+    """Convert a whole DeviceList, see DeviceListConverter"""
+    converter = DeviceListConverter(previous)
+    for device in sunpower_data["devices"]:
+        converter.add(device)
+    return converter.close()
+
+
+def freeze(data, previous):
+    """Make a converted sample a read only snapshot, safe to hand to every entity and keep
+    for diffing without copying.  A device type whose records are exactly those of previous
+    reuses previous's mapping, so unchanged parts are shared between snapshots (and skipped
+    as a whole when diffing)."""
+    frozen = {}
+    for device_type, devices in data.items():
+        shared = previous.get(device_type)
+        if isinstance(devices, MappingProxyType):
+            frozen[device_type] = devices  # already part of a snapshot
+        elif same_records(devices, shared):
+            frozen[device_type] = shared
+        else:
+            frozen[device_type] = MappingProxyType(devices)
+    return MappingProxyType(frozen)
+
+
+def same_records(devices, shared):
+    """Does shared hold exactly these record objects"""
+    if shared is None or len(shared) != len(devices):
+        return False
+    return all(shared.get(serial) is record for serial, record in devices.items())
+
+
+def diff_snapshots(previous, data):
+    """(device_type, serial) -> set of changed fields for every device that differs from
+    previous, None for a device that is new or gone.  Devices shared with previous (same
+    record) and devices with equal fields are skipped without looking at individual fields."""
+    changes = {}
+    for device_type, previous_devices in previous.items():
+        devices = data.get(device_type, {})
+        if devices is previous_devices:
+            continue
+        for serial in previous_devices.keys() - devices.keys():
+            changes[(device_type, serial)] = None
+    for device_type, devices in data.items():
+        previous_devices = previous.get(device_type, {})
+        if devices is previous_devices:
+            continue
+        for serial, device in devices.items():
+            previous_device = previous_devices.get(serial)
+            if device is previous_device:
+                continue
+            if previous_device is None:
+                changes[(device_type, serial)] = None
+                continue
+            fields = device.fields
+            previous_fields = previous_device.fields
+            if fields == previous_fields:
+                continue
+            changes[(device_type, serial)] = {
+                key
+                for key in fields.keys() | previous_fields.keys()
+                if fields.get(key) != previous_fields.get(key)
+            }
+    return changes
+
+
+def compile_path(path):
+    """Turn a path of keys into one function that walks it"""
+    getters = tuple(itemgetter(key) for key in path)
+    if len(getters) == 1:
+        return getters[0]
+
+    def accessor(device):
+        for getter in getters:
+            device = getter(device)
+        return device
+
+    return accessor
+
+
+# (device type, ess_report section, ((field, accessor), ...)) compiled once at import
+ESS_EXTRACTORS = tuple(
+    (
+        device_type,
+        section,
+        tuple((field, compile_path(path)) for field, path in fields.items()),
+    )
+    for device_type, (section, fields) in SUNVAULT_ESS_FIELDS.items()
+)
+
+
+def layer_device(data, pvs_data, device_type, serial, fields):
+    """Copy-on-write a PVS device into data with ESS fields added, without touching the
+    converted PVS sample which stays shared between ESS polls"""
+    if data.get(device_type) is pvs_data.get(device_type):
+        data[device_type] = dict(pvs_data.get(device_type, {}))
+    device = DeviceRecord({**data[device_type][serial].fields, **fields})
+    data[device_type][serial] = device
+    return device
+
+
+def convert_ess_data(ess_data, pvs_data):
+    """Do all the gymnastics to Integrate ESS data from its unique data source into the PVS data
+    Returns a new snapshot layering ESS data over the PVS snapshot, sharing the device types
+    the ESS does not touch.
+    One pass over ess_report extracts every field in SUNVAULT_ESS_FIELDS and sums the
+    battery totals for the virtual SunVault at the same time."""
+    data = dict(pvs_data)
+    ess_report = ess_data["ess_report"]
+    batteries = 0
+    sunvault_amperage = 0
+    sunvault_voltage = 0
+    sunvault_temperature = 0
+    customer_state_of_charge = 0
+    system_state_of_charge = 0
+    sunvault_power = 0
+    sunvault_power_input = 0
+    sunvault_power_output = 0
+    sunvault_state = "working"
+    for device_type, section, accessors in ESS_EXTRACTORS:
+        devices = ess_report[section]
+        if isinstance(devices, dict):  # the HUB+ is reported on its own, not in a list
+            devices = (devices,)
+        for device in devices:
+            fields = {field: accessor(device) for field, accessor in accessors}
+            record = layer_device(data, pvs_data, device_type, device["serial_number"], fields)
+            if device_type != BATTERY_DEVICE_TYPE:
+                continue
+            if record.state != "working":
+                sunvault_state = record.state
+            amperage = fields["battery_amperage"]
+            power = amperage * fields["battery_voltage"]
+            batteries += 1
+            sunvault_amperage += amperage
+            sunvault_voltage += fields["battery_voltage"]
+            sunvault_temperature += fields["temperature"]
+            customer_state_of_charge += fields["customer_state_of_charge"]
+            system_state_of_charge += fields["system_state_of_charge"]
+            sunvault_power += power
+            if amperage < 0:
+                sunvault_power_output += abs(power)
+            elif amperage > 0:
+                sunvault_power_input += power
+    # Generate a usable serial number for this virtual device, use PVS serial as base
+    # since we must be talking through one and it has a serial
+    pvs_serial = next(iter(data[PVS_DEVICE_TYPE]))  # only one PVS
+    sunvault_serial = f"sunvault_{pvs_serial}"
+    data[SUNVAULT_DEVICE_TYPE] = {
+        sunvault_serial: DeviceRecord(
+            {
+                "sunvault_amperage": sunvault_amperage,
+                "sunvault_voltage": sunvault_voltage / batteries,
+                "sunvault_temperature": sunvault_temperature / batteries,
+                "sunvault_customer_state_of_charge": customer_state_of_charge / batteries,
+                "sunvault_system_state_of_charge": system_state_of_charge / batteries,
+                "sunvault_power_input": sunvault_power_input,
+                "sunvault_power_output": sunvault_power_output,
+                "sunvault_power": sunvault_power,
+                "STATE": sunvault_state,
+                "SERIAL": sunvault_serial,
+                "SWVER": "1.0",
+                "HWVER": "Virtual",
+                "DESCR": "Virtual SunVault",
+                "MODEL": "Virtual SunVault",
+            },
+        ),
+    }
+    return freeze(data, pvs_data)
@@ -0,0 +1,618 @@
+"""Per data source polling for the sunpower integration."""
+
+import logging
+import random
+from collections import deque
+from datetime import timedelta
+
+from homeassistant.core import (
+    HomeAssistant,
+    callback,
+)
+from homeassistant.helpers import device_registry as dr
+from homeassistant.helpers.aiohttp_client import async_create_clientsession
+from homeassistant.helpers.event import async_track_sunrise
+from homeassistant.helpers.storage import Store
+from homeassistant.helpers.sun import get_astral_location
+from homeassistant.helpers.update_coordinator import (
+    DataUpdateCoordinator,
+    UpdateFailed,
+)
+from homeassistant.util import dt as dt_util
+
+from .const import (
+    DAYLIGHT_ELEVATION,
+    DOMAIN,
+    ESS_DEVICE_TYPE,
+    ESS_SAMPLE,
+    INVERTER_DEVICE_TYPE,
+    LOAD_HIGH_CPU,
+    LOAD_LOW_CPU,
+    LOAD_MAX_FACTOR,
+    LOAD_MIN_FLASH,
+    LOAD_RELAX,
+    LOAD_STRETCH,
+    LOAD_TREND_MEASUREMENTS,
+    MISSING_DEVICES,
+    PHASE_LAG,
+    PHASE_MIN_ADVANCES,
+    PHASE_MIN_PERIOD,
+    PHASE_WINDOW,
+    PVS_DEVICE_TYPE,
+    PVS_SAMPLE,
+    SAMPLE_FETCHED,
+    SNAPSHOT_SAVE_DELAY,
+    SOURCE_JITTER_FRACTION,
+    SOURCE_MAX_BACKOFF,
+    STORAGE_VERSION,
+    SUNVAULT_DEVICE_TYPE,
+)
+from .convert import (
+    DeviceListConverter,
+    convert_ess_data,
+    convert_sunpower_data,
+    diff_snapshots,
+    parse_time,
+)
+from .sunpower import (
+    AsyncSunPowerMonitor,
+    ConnectionException,
+    GovernorException,
+    ParseException,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class SunPowerSourceCoordinator(DataUpdateCoordinator):
+    """Polls one PVS data source (DeviceList, ESS status, ...) on its own schedule.
+    Each source has its own interval, a little random jitter so sources sharing a PVS
+    drift apart instead of colliding, and exponential backoff after consecutive failures.
+    Only entities built on this coordinator are notified when it updates, and each poll is
+    diffed against the last so entities whose value did not change can skip writing state.
+    Data restored from a previous run is flagged stale until the first live poll lands.
+    With a grace_period (seconds) a failed poll keeps serving, flagged stale, the last good
+    sample as long as it is no older than that instead of making every entity unavailable.
+    load_factor stretches the interval while the PVS is struggling, see PVSLoad.
+    While night is set polls are night_interval apart instead, when there is one.
+    With a phase (see PVSPhase) healthy polls are moved onto the source's own update cycle,
+    once it has been learnt, instead of being jittered."""
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        name,
+        fetch_method,
+        interval,
+        jitter=SOURCE_JITTER_FRACTION,
+        max_backoff=SOURCE_MAX_BACKOFF,
+        grace_period=0,
+        night_interval=0,
+    ):
+        """Initialize."""
+        super().__init__(
+            hass,
+            _LOGGER,
+            name=name,
+            update_interval=timedelta(seconds=interval),
+        )
+        self._fetch_method = fetch_method
+        self.interval = interval
+        self.jitter = jitter
+        self.max_backoff = max_backoff
+        self.grace_period = grace_period
+        self.night_interval = night_interval
+        self.night = False
+        self.phase = None
+        self.failures = 0
+        self.load_factor = 1.0
+        # When the data being served was fetched, None when that is not known
+        self.last_success = None
+        # (device_type, serial) -> fields that changed in the last poll, None for everything
+        self.changes = None
+        self.stale = False
+        self._notified_success = None
+
+    def next_interval(self):
+        """Seconds until the next poll, stretched by PVS load, backed off by recent failures
+        then phase locked or jittered"""
+        base = self.night_interval if self.night and self.night_interval else self.interval
+        interval = base * self.load_factor * min(2**self.failures, self.max_backoff)
+        # Until the phase has learnt the scan period polls are jittered like any other
+        if self.phase is not None and self.phase.period is not None and self.failures == 0:
+            return self.phase.delay(interval, dt_util.utcnow())
+        return interval + random.uniform(0, interval * self.jitter)
+
+    def _reschedule(self, not_before=0):
+        # DataUpdateCoordinator schedules the next refresh from update_interval once
+        # _async_update_data returns, so setting it here applies to the very next poll
+        self.update_interval = timedelta(seconds=max(self.next_interval(), not_before))
+
+    @callback
+    def async_set_schedule(self, interval, night_interval=0, grace_period=0):
+        """Apply changed options, a new interval moves the pending poll instead of waiting
+        out the old one"""
+        self.grace_period = grace_period
+        if (interval, night_interval) == (self.interval, self.night_interval):
+            return
+        self.interval = interval
+        self.night_interval = night_interval
+        if not night_interval:
+            self.night = False
+        self._reschedule()
+        # Nothing is scheduled while no entity listens, the first listener schedules it
+        if self._listeners:
+            self._schedule_refresh()
+
+    def within_grace(self):
+        """Is the last good sample still recent enough to serve after a failed poll"""
+        if not self.grace_period or self.data is None or self.last_success is None:
+            return False
+        age = (dt_util.utcnow() - self.last_success).total_seconds()
+        return age <= self.grace_period
+
+    async def _async_update_data(self):
+        """Fetch and convert one sample from this source"""
+        try:
+            data = await self._fetch_method()
+        except GovernorException as error:
+            # Nothing was sent and the governor has its own backoff, so this is not another
+            # failure to back off from, the next poll only waits until the governor allows it
+            return self._failed(error, error.retry_after)
+        except (ParseException, ConnectionException) as error:
+            self.failures += 1
+            return self._failed(error)
+        self.failures = 0
+        self.last_success = dt_util.utcnow()
+        # Everything is rewritten after restored data so entities drop their stale flag
+        self.changes = (
+            diff_snapshots(self.data, data)
+            if self.data is not None and self.last_update_success and not self.stale
+            else None
+        )
+        self.stale = False
+        self._reschedule()
+        return data
+
+    def _failed(self, error, not_before=0):
+        """The last good sample while within grace_period, otherwise raise UpdateFailed"""
+        self.changes = None
+        self._reschedule(not_before)
+        if self.within_grace():
+            _LOGGER.debug("Serving last %s data after failed poll: %r", self.name, error)
+            self.stale = True
+            return self.data
+        raise UpdateFailed(str(error)) from error
+
+    @callback
+    def async_restore(self, data, fetched=None):
+        """Serve data persisted by a previous run, flagged stale until the first live poll
+        lands.  With when it was fetched a failed poll keeps serving it within grace_period"""
+        self.stale = True
+        self.async_set_updated_data(data)
+        self.last_success = fetched
+
+    def has_changed(self, device_type, serial, field):
+        """Did this field change in the last poll"""
+        if self.changes is None:
+            return True
+        fields = self.changes.get((device_type, serial), ())
+        return fields is None or field in fields
+
+    @callback
+    def async_update_listeners(self):
+        """Skip the whole dispatch when nothing changed and availability did not flip"""
+        if self.changes == {} and self.last_update_success == self._notified_success:
+            return
+        self._notified_success = self.last_update_success
+        super().async_update_listeners()
+
+
+def is_number(value):
+    return isinstance(value, (int, float))
+
+
+class PVSLoad:
+    """Tracks the PVS's own health counters to decide how hard it can be polled.
+    factor multiplies every poll interval of the PVS, it grows while the PVS is struggling
+    and shrinks back towards 1 while it is healthy."""
+
+    def __init__(self):
+        """Initialize."""
+        self.factor = 1.0
+        self.reasons = ()
+        self._record = None
+        self._untransmitted_growth = 0
+        self._flash_shrink = 0
+
+    def _trend(self, streak, field, record, growing):
+        """Measurements in a row a counter has moved in the worrying direction"""
+        previous = self._record.get(field) if self._record is not None else None
+        current = record.get(field)
+        if not (is_number(previous) and is_number(current)):
+            return 0
+        worse = current > previous if growing else current < previous
+        return streak + 1 if worse else 0
+
+    def update(self, record):
+        """Take in a new PVS measurement, True when factor changed"""
+        if record is self._record:
+            return False  # the PVS has not measured again since the last poll
+        self._untransmitted_growth = self._trend(
+            self._untransmitted_growth,
+            "dl_untransmitted",
+            record,
+            growing=True,
+        )
+        self._flash_shrink = self._trend(
+            self._flash_shrink,
+            "dl_flash_avail",
+            record,
+            growing=False,
+        )
+        previous_skipped = self._record.get("dl_skipped_scans") if self._record else None
+        skipped = record.get("dl_skipped_scans")
+        cpu_load = record.get("dl_cpu_load")
+        flash = record.get("dl_flash_avail")
+        self._record = record
+
+        reasons = []
+        if is_number(cpu_load) and cpu_load > LOAD_HIGH_CPU:
+            reasons.append("cpu_load")
+        if is_number(skipped) and is_number(previous_skipped) and skipped > previous_skipped:
+            reasons.append("skipped_scans")
+        if self._untransmitted_growth >= LOAD_TREND_MEASUREMENTS:
+            reasons.append("untransmitted")
+        if self._flash_shrink >= LOAD_TREND_MEASUREMENTS:
+            reasons.append("flash_shrinking")
+        if is_number(flash) and flash < LOAD_MIN_FLASH:
+            reasons.append("flash_low")
+        self.reasons = tuple(reasons)
+
+        factor = self.factor
+        if reasons:
+            factor = min(round(factor * LOAD_STRETCH, 2), LOAD_MAX_FACTOR)
+        elif is_number(cpu_load) and cpu_load < LOAD_LOW_CPU:
+            factor = max(round(factor * LOAD_RELAX, 2), 1.0)
+        if factor == self.factor:
+            return False
+        _LOGGER.debug("PVS load %s, poll interval factor %.2f", reasons, factor)
+        self.factor = factor
+        return True
+
+
+class PVSPhase:
+    """Learns when the PVS publishes new inverter data so polls land just after it.
+    The PVS scans its inverters on its own cycle, each scan advances their DATATIME.  A poll
+    at a fixed interval unrelated to that cycle is on average half a scan late, so instead
+    each poll is moved to PHASE_LAG after the expected scan nearest to when it was due, when
+    one is within half an interval.  Polls moved earlier are made up by later ones (drift),
+    so the average request rate stays the configured one."""
+
+    def __init__(self):
+        """Initialize."""
+        self.period = None
+        self.measured_at = None
+        # Our clock minus the PVS's, from its CURTIME
+        self.skew = timedelta(0)
+        # Seconds polls have been sent behind (+) or ahead of (-) their unlocked schedule
+        self.drift = 0.0
+        self._advances = deque(maxlen=PHASE_WINDOW)
+
+    def observe(self, data, curtime, received):
+        """Take in a converted DeviceList sample, the PVS's CURTIME as it sent it and when
+        (utc) we received it"""
+        curtime = parse_time(curtime)
+        if curtime is not None:
+            self.skew = received - curtime
+        inverters = data.get(INVERTER_DEVICE_TYPE, {}).values()
+        measured_at = max(
+            filter(None, (inverter.measured_at for inverter in inverters)),
+            default=None,
+        )
+        if measured_at is None:
+            return
+        previous = self.measured_at
+        if previous is not None and measured_at <= previous:
+            return  # the PVS has not scanned again since the last poll
+        self.measured_at = measured_at
+        if previous is None:
+            return
+        advance = (measured_at - previous).total_seconds()
+        if advance < PHASE_MIN_PERIOD:
+            return
+        # Polls slower than the scans see several at once, the smallest advance is one scan
+        # or the closest multiple of one, either keeps polls in step with the scans
+        self._advances.append(advance)
+        if len(self._advances) >= PHASE_MIN_ADVANCES:
+            self.period = min(self._advances)
+
+    def delay(self, interval, now):
+        """Seconds until the poll due interval seconds from now should be sent"""
+        if self.period is None:
+            return interval
+        # An interval change can leave more drift than the new interval allows
+        drift = min(max(self.drift, -interval / 2), interval / 2)
+        due = interval - drift
+        # When the next scan after the last one seen should be readable, on our clock
+        first = (self.measured_at + self.skew - now).total_seconds() + self.period + PHASE_LAG
+        # Scans due around the unlocked poll time, take whichever is closest
+        scans = (due - first) // self.period
+        later = first + (scans + 1) * self.period
+        earlier = later - self.period
+        delay = earlier if due - earlier < later - due else later
+        if abs(delay - due) > interval / 2:
+            delay = due  # no scan near enough, scans are slower than polls
+        delay = max(delay, 0)
+        self.drift = drift + delay - interval
+        return delay
+
+
+def pvs_curtime(sunpower_data):
+    """The PVS's own clock in a raw DeviceList, converted records may be from an older poll"""
+    for device in sunpower_data.get("devices", ()):
+        if device.get("DEVICE_TYPE") == PVS_DEVICE_TYPE:
+            return device.get("CURTIME")
+    return None
+
+
+def snapshot_store(hass: HomeAssistant, entry_id):
+    """Where the last good raw samples of a config entry are kept between runs"""
+    return Store(hass, STORAGE_VERSION, f"{DOMAIN}.{entry_id}")
+
+
+class SunPowerPoller:
+    """All of the polling state for one config entry (one PVS): its client, session,
+    per source coordinators and persisted samples.  Nothing here is shared with other entries
+    except poll_limiter, a semaphore capping how many PVS requests run at once across the
+    whole instance.
+    With a night_interval DeviceList is polled at that while there is no sun to produce from,
+    the ESS keeps its own interval as batteries work through the night.
+    With retire_days devices the PVS has not listed for that many days are removed from
+    the device registry, along with their entities."""
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        entry_id,
+        host,
+        pvs_interval,
+        ess_interval,
+        poll_limiter,
+        governor,
+        grace_period=0,
+        adaptive_timeout=False,
+        night_interval=0,
+        retire_days=0,
+    ):
+        """Initialize."""
+        self.hass = hass
+        self.entry_id = entry_id
+        self.retire_days = retire_days
+        # serial -> when a registered device was first found missing from the data, kept in
+        # the store so retire_days counts across restarts
+        self._missing = {}
+        self.host = host
+        self.ess_interval = ess_interval
+        self.grace_period = grace_period
+        self.poll_limiter = poll_limiter
+        self.governor = governor
+        # Created by Home Assistant so it is closed on unload and at shutdown, which does not
+        # unload config entries
+        self.monitor = AsyncSunPowerMonitor(
+            host,
+            session=async_create_clientsession(hass),
+            adaptive_timeout=adaptive_timeout,
+            governor=governor,
+        )
+        self.load = PVSLoad()
+        self.store = snapshot_store(hass, entry_id)
+        # Latest raw sample of each source, what the store writes
+        self._samples = {}
+        self.pvs_coordinator = SunPowerSourceCoordinator(
+            hass,
+            f"SunPower PVS {host}",
+            self.async_update_pvs,
+            pvs_interval,
+            grace_period=grace_period,
+            night_interval=night_interval,
+        )
+        self.pvs_coordinator.phase = PVSPhase()
+        self.ess_coordinator = None
+
+    async def async_update_pvs(self):
+        """Fetch and index DeviceList, used by the PVS coordinator"""
+        # Devices are converted as they stream in, only what entities read is kept, in
+        # memory and in the persisted sample
+        async with self.poll_limiter:
+            converter = await self.monitor.device_list(self._new_converter)
+        data = converter.snapshot
+        sunpower_data = {"devices": converter.devices}
+        _LOGGER.debug("got PVS data %s", sunpower_data)
+        self._async_save_sample(PVS_SAMPLE, sunpower_data)
+        self.pvs_coordinator.phase.observe(data, pvs_curtime(sunpower_data), dt_util.utcnow())
+        self._update_load(data)
+        if self.pvs_coordinator.night_interval:
+            self.pvs_coordinator.night = self._is_night(data)
+        if self.retire_days:
+            self._async_retire_missing(data)
+        return data
+
+    def _new_converter(self):
+        """Converter for the next DeviceList, against the current snapshot"""
+        return DeviceListConverter(self.pvs_coordinator.data)
+
+    @callback
+    def _async_retire_missing(self, data):
+        """Remove devices of this entry that no poll has listed for retire_days"""
+        present = {serial for devices in data.values() for serial in devices}
+        if self.ess_coordinator is not None and self.ess_coordinator.data:
+            # The virtual SunVault only exists in the ESS data, every other device type there
+            # is layered over an older DeviceList and would keep a removed device present
+            present.update(self.ess_coordinator.data.get(SUNVAULT_DEVICE_TYPE, ()))
+        now = dt_util.utcnow()
+        registry = dr.async_get(self.hass)
+        missing = {}
+        for device in dr.async_entries_for_config_entry(registry, self.entry_id):
+            serial = next(
+                (identifier for domain, identifier in device.identifiers if domain == DOMAIN),
+                None,
+            )
+            if serial is None or serial in present:
+                continue
+            missing_since = self._missing.get(serial, now)
+            if now - missing_since < timedelta(days=self.retire_days):
+                missing[serial] = missing_since
+                continue
+            _LOGGER.info("Retiring %s, the PVS has not listed it since %s", serial, missing_since)
+            registry.async_update_device(device.id, remove_config_entry_id=self.entry_id)
+        # Devices that came back or were removed from the registry are dropped as well
+        if missing != self._missing:
+            self._missing = missing
+            self._async_save_missing()
+
+    @callback
+    def _async_save_missing(self):
+        self._samples[MISSING_DEVICES] = {
+            serial: since.isoformat() for serial, since in self._missing.items()
+        }
+        self.store.async_delay_save(lambda: self._samples, SNAPSHOT_SAVE_DELAY)
+
+    def _load_missing(self):
+        """When each device was first found missing, from the stored samples"""
+        missing = {}
+        for serial, since in (self._samples.get(MISSING_DEVICES) or {}).items():
+            since = dt_util.parse_datetime(since) if isinstance(since, str) else None
+            if since is not None:
+                missing[serial] = since
+        return missing
+
+    @callback
+    def async_apply_options(
+        self,
+        pvs_interval,
+        ess_interval,
+        grace_period=0,
+        adaptive_timeout=False,
+        night_interval=0,
+        retire_days=0,
+    ):
+        """Apply changed options to the running poller, its coordinators keep their data and
+        entities"""
+        self.ess_interval = ess_interval
+        self.grace_period = grace_period
+        self.monitor.adaptive_timeout = adaptive_timeout
+        self.retire_days = retire_days
+        if not retire_days and self._missing:
+            # Not tracked while disabled, so they would be out of date if enabled again
+            self._missing = {}
+            self._async_save_missing()
+        self.pvs_coordinator.async_set_schedule(
+            pvs_interval,
+            night_interval=night_interval,
+            grace_period=grace_period,
+        )
+        if self.ess_coordinator is not None:
+            self.ess_coordinator.async_set_schedule(ess_interval, grace_period=grace_period)
+
+    def _is_night(self, data):
+        """No production to poll for: the sun is down, or well up yet every inverter
+        reports zero (snow, shade, grid outage)"""
+        location, elevation = get_astral_location(self.hass)
+        sun_elevation = location.solar_elevation(dt_util.utcnow(), elevation)
+        if sun_elevation < 0:
+            return True
+        if sun_elevation <= DAYLIGHT_ELEVATION:
+            return False  # dawn or dusk, watch for production to start
+        inverters = data.get(INVERTER_DEVICE_TYPE, {}).values()
+        return len(inverters) > 0 and all(
+            inverter.get("p_mppt1_kw") == 0 for inverter in inverters
+        )
+
+    @callback
+    def _async_sunrise(self):
+        """Back to the day interval at dawn instead of sleeping out a night interval"""
+        if self.pvs_coordinator.night:
+            self.pvs_coordinator.night = False
+            self.hass.async_create_task(self.pvs_coordinator.async_request_refresh())
+
+    def _update_load(self, data):
+        """Stretch or relax every poll interval of this PVS by its health counters"""
+        pvs = next(iter(data.get(PVS_DEVICE_TYPE, {}).values()), None)
+        if pvs is None or not self.load.update(pvs):
+            return
+        for coordinator in (self.pvs_coordinator, self.ess_coordinator):
+            if coordinator is not None:
+                coordinator.load_factor = self.load.factor
+
+    async def async_update_ess(self):
+        """Fetch ESS status and layer it over the latest PVS data"""
+        async with self.poll_limiter:
+            ess_data = await self.monitor.energy_storage_system_status()
+        _LOGGER.debug("got ESS data %s", ess_data)
+        # The converted PVS sample is reused as is, ESS data is layered over a copy
+        data = convert_ess_data(ess_data, self.pvs_coordinator.data)
+        self._async_save_sample(ESS_SAMPLE, ess_data)
+        return data
+
+    @callback
+    def _async_save_sample(self, source, sample):
+        """Persist the latest good raw sample of a source and when it was fetched, writes are
+        coalesced"""
+        self._samples[source] = sample
+        self._samples.setdefault(SAMPLE_FETCHED, {})[source] = dt_util.utcnow().isoformat()
+        self.store.async_delay_save(lambda: self._samples, SNAPSHOT_SAVE_DELAY)
+
+    async def _async_load(self, entry, coordinator, source, convert):
+        """Serve the persisted sample straight away and poll the PVS in the background,
+        with nothing persisted (first setup) wait for the PVS, if it does not answer the
+        entry is not ready and Home Assistant retries the setup with its own backoff"""
+        sample = self._samples.get(source)
+        if sample is not None:
+            try:
+                data = convert(sample)
+            except (KeyError, TypeError, ValueError, StopIteration):
+                _LOGGER.warning("Ignoring unreadable stored %s sample", source)
+            else:
+                fetched = (self._samples.get(SAMPLE_FETCHED) or {}).get(source)
+                coordinator.async_restore(
+                    data,
+                    dt_util.parse_datetime(fetched) if isinstance(fetched, str) else None,
+                )
+                entry.async_create_background_task(
+                    self.hass,
+                    coordinator.async_refresh(),
+                    f"{coordinator.name} refresh",
+                )
+                return
+        await coordinator.async_config_entry_first_refresh()
+
+    async def async_setup(self, entry):
+        """Load the first samples, the ESS has its own endpoint and schedule so it is only
+        polled once the PVS lists one"""
+        self._samples = await self.store.async_load() or {}
+        self._missing = self._load_missing()
+        # Tracked even without a night interval, as one can be set without a reload
+        entry.async_on_unload(async_track_sunrise(self.hass, self._async_sunrise))
+        await self._async_load(entry, self.pvs_coordinator, PVS_SAMPLE, convert_sunpower_data)
+        if self.pvs_coordinator.data and ESS_DEVICE_TYPE in self.pvs_coordinator.data:
+            self.ess_coordinator = SunPowerSourceCoordinator(
+                self.hass,
+                f"SunPower ESS {self.host}",
+                self.async_update_ess,
+                self.ess_interval,
+                grace_period=self.grace_period,
+            )
+            self.ess_coordinator.load_factor = self.load.factor
+            await self._async_load(
+                entry,
+                self.ess_coordinator,
+                ESS_SAMPLE,
+                lambda sample: convert_ess_data(sample, self.pvs_coordinator.data),
+            )
+        else:
+            _LOGGER.debug("Found No ESS Data")
+
+    async def async_close(self):
+        """Abort any poll still in flight, Home Assistant closes the session"""
+        await self.monitor.close()
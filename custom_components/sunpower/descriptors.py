@@ -0,0 +1,120 @@
+"""Entity descriptions compiled once from the descriptor tables in const.py."""
+
+from dataclasses import dataclass
+from string import Formatter
+from types import MappingProxyType
+
+from .const import (
+    PVS_DEVICE_TYPE,
+    SUNPOWER_BINARY_SENSORS,
+    SUNPOWER_COORDINATOR,
+    SUNPOWER_POLL_SENSORS,
+    SUNPOWER_SENSORS,
+    SUNVAULT_BINARY_SENSORS,
+    SUNVAULT_COORDINATOR,
+    SUNVAULT_DEVICE_TYPE,
+    SUNVAULT_SENSORS,
+)
+
+
+class TitleTemplate:
+    """A const.py title split once into (literal, name) parts, so naming an entity is a join
+    of the literals with the names it uses instead of parsing the title again each time"""
+
+    __slots__ = ("parts",)
+
+    def __init__(self, template):
+        """Initialize."""
+        self.parts = tuple(
+            (literal, name) for literal, name, _spec, _conversion in Formatter().parse(template)
+        )
+
+    def render(self, names):
+        """The title with each {name} replaced from names"""
+        return "".join(literal + names[name] if name else literal for literal, name in self.parts)
+
+
+@dataclass(frozen=True, slots=True)
+class SunPowerDescription:
+    """One entity of a device type: which field it shows, how it is titled and presented and
+    which coordinator (a key into the entry's hass.data) updates it.
+    Poll diagnostics also have a source (another key into the entry's hass.data) to read field
+    from instead of the coordinator, and args to call it with."""
+
+    key: str
+    device_type: str
+    id_code: str
+    field: str
+    title: TitleTemplate
+    device_class: str | None = None
+    unit: str | None = None
+    icon: str | None = None
+    state_class: str | None = None
+    entity_category: str | None = None
+    on_value: str | None = None
+    coordinator: str = SUNPOWER_COORDINATOR
+    source: str | None = None
+    args: tuple | None = None
+
+
+def compile_descriptions(table, ess_device_types=()):
+    """device type -> its descriptions, from a (binary) sensor table in const.py.
+    Device types in ess_device_types are updated by the ESS coordinator"""
+    return MappingProxyType(
+        {
+            device_type: tuple(
+                SunPowerDescription(
+                    key=key,
+                    device_type=device_type,
+                    id_code=descriptor["unique_id"],
+                    field=sensor["field"],
+                    title=TitleTemplate(sensor["title"]),
+                    device_class=sensor.get("device"),
+                    unit=sensor.get("unit"),
+                    icon=sensor.get("icon"),
+                    state_class=sensor.get("state"),
+                    entity_category=sensor.get("entity_category"),
+                    on_value=sensor.get("on_value"),
+                    coordinator=(
+                        SUNVAULT_COORDINATOR
+                        if device_type in ess_device_types
+                        else SUNPOWER_COORDINATOR
+                    ),
+                )
+                for key, sensor in descriptor["sensors"].items()
+            )
+            for device_type, descriptor in table.items()
+        },
+    )
+
+
+# ESS fields come from their own endpoint, so they follow the ESS schedule
+SENSOR_DESCRIPTIONS = compile_descriptions(SUNPOWER_SENSORS)
+SUNVAULT_SENSOR_DESCRIPTIONS = compile_descriptions(
+    SUNVAULT_SENSORS,
+    ess_device_types=SUNVAULT_SENSORS,
+)
+# The virtual SunVault is built from ESS data, every other state comes from the PVS
+BINARY_SENSOR_DESCRIPTIONS = compile_descriptions(SUNPOWER_BINARY_SENSORS)
+SUNVAULT_BINARY_SENSOR_DESCRIPTIONS = compile_descriptions(
+    SUNVAULT_BINARY_SENSORS,
+    ess_device_types=(SUNVAULT_DEVICE_TYPE,),
+)
+POLL_SENSOR_DESCRIPTIONS = tuple(
+    SunPowerDescription(
+        key=key,
+        device_type=PVS_DEVICE_TYPE,
+        id_code=key.lower(),
+        field=sensor["attribute"],
+        title=TitleTemplate(sensor["title"]),
+        device_class=sensor["device"],
+        unit=sensor["unit"],
+        icon=sensor["icon"],
+        state_class=sensor["state"],
+        entity_category=sensor.get("entity_category"),
+        coordinator=sensor["coordinator"],
+        source=sensor.get("source"),
+        args=sensor.get("args"),
+    )
+    for key, sensor in SUNPOWER_POLL_SENSORS.items()
+)
@@ -1,17 +1,181 @@
 """The Sunpower integration base entity."""
 
+import logging
+from functools import partial
+
+from homeassistant.core import callback
 from homeassistant.helpers.update_coordinator import CoordinatorEntity
 
-from .const import DOMAIN
+from .const import (
+    DOMAIN,
+    PVS_DEVICE_TYPE,
+    SUNPOWER_COORDINATOR,
+    SUNPOWER_DESCRIPTIVE_NAMES,
+    SUNPOWER_PRODUCT_NAMES,
+    SUNVAULT_COORDINATOR,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def title_names(config_entry):
+    """Title parts that only depend on the entry's naming options"""
+    do_product_names = config_entry.data.get(SUNPOWER_PRODUCT_NAMES, False)
+    return {
+        "SUN_POWER": "" if not do_product_names else "SunPower ",
+        "SUN_VAULT": "" if not do_product_names else "SunVault ",
+        "PVS": "" if not do_product_names else "PVS ",
+    }
+
+
+class DeviceEntities:
+    """A platform's entities for the devices in the data, built by joining the descriptions
+    of each device type (see descriptors.py) with every device of that type.
+    Entities are created at setup and then for whatever shows up in a later poll (an inverter
+    that was offline at startup, a panel added to the site) without reloading the entry.
+    ess_descriptions are only used when the ESS is polled.  create(coordinator, device,
+    parent, description, title) builds one entity, or returns None to leave it out"""
+
+    def __init__(self, sunpower_state, config_entry, descriptions, ess_descriptions, create):
+        """Initialize."""
+        self.sunpower_state = sunpower_state
+        self.config_entry = config_entry
+        self.create = create
+        ess_coordinator = sunpower_state[SUNVAULT_COORDINATOR]
+        if ess_coordinator is not None and ess_coordinator.data:
+            descriptions = {**descriptions, **ess_descriptions}
+        else:
+            _LOGGER.debug("Found No ESS Data")
+        self.descriptions = descriptions
+        self.do_descriptive_names = config_entry.data.get(SUNPOWER_DESCRIPTIVE_NAMES, False)
+        self.entry_names = title_names(config_entry)
+        # (device_type, serial, description key) of every entity created so far
+        self.created = set()
+
+    def new_entities(self, log_missing=False):
+        """Entities for every described field of every device that does not have one yet"""
+        pvs_data = self.sunpower_state[SUNPOWER_COORDINATOR].data
+        if PVS_DEVICE_TYPE not in pvs_data:
+            if log_missing:
+                _LOGGER.error("Cannot find PVS Entry")
+            return []
+
+        pvs = next(iter(pvs_data[PVS_DEVICE_TYPE].values()))
+        entities = []
+        for device_type, device_descriptions in self.descriptions.items():
+            # Every description of a device type is updated by the same coordinator
+            coordinator = self.sunpower_state[device_descriptions[0].coordinator]
+            devices = coordinator.data.get(device_type)
+            if devices is None:
+                if log_missing:
+                    _LOGGER.error(f"Cannot find any {device_type}")
+                continue
+            parent = pvs if device_type != PVS_DEVICE_TYPE else None
+            for index, device in enumerate(devices.values()):
+                names = None
+                for description in device_descriptions:
+                    key = (device_type, device.serial, description.key)
+                    if key in self.created:
+                        continue
+                    if names is None:
+                        names = self._names(device, index)
+                    entity = self.create(
+                        coordinator,
+                        device,
+                        parent,
+                        description,
+                        description.title.render(names),
+                    )
+                    if entity is not None:
+                        self.created.add(key)
+                        # A retired device gets new entities should it come back
+                        entity.async_on_remove(partial(self.created.discard, key))
+                        entities.append(entity)
+        return entities
+
+    def _names(self, device, index):
+        """Everything a title can use, worked out once per device"""
+        do_descriptive_names = self.do_descriptive_names
+        return {
+            **self.entry_names,
+            "index": "" if not do_descriptive_names else f"{index + 1} ",
+            "TYPE": "" if not do_descriptive_names else f"{device.get('TYPE', '')} ",
+            "DESCR": "" if not do_descriptive_names else f"{device.get('DESCR', '')} ",
+            "SERIAL": device.get("SERIAL", "Unknown"),
+            "MODEL": device.get("MODEL", "Unknown"),
+        }
+
+    @callback
+    def async_track(self, async_add_entities):
+        """Add the entities of devices that appear in later polls"""
+        coordinators = {
+            description.coordinator
+            for device_descriptions in self.descriptions.values()
+            for description in device_descriptions
+        }
+        for coordinator in coordinators:
+            self.config_entry.async_on_unload(
+                self.sunpower_state[coordinator].async_add_listener(
+                    self._discovery_listener(self.sunpower_state[coordinator], async_add_entities),
+                ),
+            )
+
+    def _discovery_listener(self, coordinator, async_add_entities):
+        @callback
+        def discover():
+            # Polls only list a new device (None) in their changes when one appeared or went
+            changes = coordinator.changes
+            if changes is not None and None not in changes.values():
+                return
+            entities = self.new_entities()
+            if entities:
+                _LOGGER.info("Adding %d entities for new devices", len(entities))
+                async_add_entities(entities)
+
+        return discover
 
 
 class SunPowerEntity(CoordinatorEntity):
-    def __init__(self, coordinator, my_info, parent_info):
+    def __init__(self, coordinator, my_info, parent_info, description, title):
         """Initialize the sensor."""
         super().__init__(coordinator)
         self._my_info = my_info
         self._parent_info = parent_info
+        self._description = description
+        self._id_code = description.id_code
+        self._device_type = description.device_type
+        self._field = description.field
+        self._title = title
         self.base_unique_id = self._my_info.get("SERIAL", "")
+        self._last_available = None
+
+    @callback
+    def _handle_coordinator_update(self):
+        """Only write state when our field changed in the last poll or availability flipped,
+        at night most per panel values are identical between polls"""
+        available = self.available
+        if available == self._last_available and not self.coordinator.has_changed(
+            self._device_type,
+            self.base_unique_id,
+            self._field,
+        ):
+            return
+        self._last_available = available
+        super()._handle_coordinator_update()
+
+    @property
+    def available(self):
+        """Also unavailable while the PVS no longer lists the device"""
+        if not super().available:
+            return False
+        return self.base_unique_id in self.coordinator.data.get(self._device_type, {})
+
+    @property
+    def extra_state_attributes(self):
+        """Flag values restored from the last run until the PVS answers"""
+        if self.coordinator.stale:
+            return {"stale": True}
+        return None
 
     @property
     def device_info(self):
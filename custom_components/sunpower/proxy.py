@@ -0,0 +1,212 @@
+""" Caching proxy for the Sunpower PVS
+
+Lets Home Assistant, collectors and scripts share the PVS for the cost of one poll.
+Runs standalone, only needs aiohttp:
+
+    python3 proxy.py --pvs 172.27.153.1 --port 80
+
+DeviceList and the ESS status are served from memory for their own TTL, concurrent
+requests for the same url while it is being fetched share that one upstream request.
+Anything else is passed through, still coalesced but not cached or kept once answered.
+Hit and miss counters are served as json from /proxy/stats
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import time
+
+import aiohttp
+from aiohttp import web
+
+DEFAULT_PVS = "172.27.153.1"
+DEFAULT_PORT = 8080
+DEFAULT_DEVICE_LIST_TTL = 120
+DEFAULT_ESS_TTL = 60
+DEFAULT_TIMEOUT = 120
+
+DL_CGI_PATH = "/cgi-bin/dl_cgi"
+ESS_PATH = "/cgi-bin/dl_cgi/energy-storage-system/status"
+STATS_PATH = "/proxy/stats"
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class CachedResponse:
+    """The last upstream response for one url and its counters"""
+
+    def __init__(self, ttl):
+        """Initialize."""
+        self.ttl = ttl
+        self.status = None
+        self.content_type = None
+        self.body = None
+        self.fetched = None
+        self.inflight = None
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.errors = 0
+
+    def fresh(self, now):
+        """Can the cached body still be served"""
+        return self.body is not None and now - self.fetched < self.ttl
+
+    def stats(self, now):
+        return {
+            "ttl": self.ttl,
+            "age": None if self.fetched is None else round(now - self.fetched, 1),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+        }
+
+
+class PVSProxy:
+    """Caches and coalesces GETs to one PVS"""
+
+    def __init__(
+        self,
+        pvs,
+        device_list_ttl=DEFAULT_DEVICE_LIST_TTL,
+        ess_ttl=DEFAULT_ESS_TTL,
+        timeout=DEFAULT_TIMEOUT,
+    ):
+        """Initialize."""
+        self.base_url = "http://{0}".format(pvs)
+        self.device_list_ttl = device_list_ttl
+        self.ess_ttl = ess_ttl
+        self.timeout = timeout
+        self.session = None
+        # Only the cacheable urls, so this cannot grow with whatever clients ask for
+        self.responses = {}
+        # Pass-through requests in flight, url -> task, and their counters
+        self.passing = {}
+        self.passed = CachedResponse(0)
+
+    def cacheable(self, request):
+        """(url, ttl) to cache a response to this request under, None to pass it through.
+        Any other query parameters are dropped so each cached url has one entry."""
+        if request.path == ESS_PATH:
+            return ESS_PATH, self.ess_ttl
+        if request.path == DL_CGI_PATH and request.query.get("Command") == "DeviceList":
+            return DL_CGI_PATH + "?Command=DeviceList", self.device_list_ttl
+        return None
+
+    async def start(self, app):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit_per_host=2, keepalive_timeout=300),
+        )
+
+    async def stop(self, app):
+        await self.session.close()
+
+    async def _fetch(self, url, cached):
+        """The one upstream request every waiter for this url shares, only a 200 for a cached
+        url is kept.
+        Returns (status, content_type, body)"""
+        try:
+            async with self.session.get(
+                self.base_url + url,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            ) as response:
+                result = (response.status, response.content_type, await response.read())
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            cached.errors += 1
+            _LOGGER.warning("PVS request %s failed: %r", url, error)
+            return (504, "text/plain", b"PVS did not answer")
+        if result[0] != 200:
+            cached.errors += 1
+            return result
+        if not cached.ttl:
+            return result
+        cached.status, cached.content_type, cached.body = result
+        cached.fetched = time.monotonic()
+        return result
+
+    async def handle(self, request):
+        cacheable = self.cacheable(request)
+        if cacheable is None:
+            return await self.pass_through(request.path_qs)
+        url, ttl = cacheable
+        cached = self.responses.get(url)
+        if cached is None:
+            cached = self.responses[url] = CachedResponse(ttl)
+        if cached.fresh(time.monotonic()):
+            cached.hits += 1
+            status, content_type, body = cached.status, cached.content_type, cached.body
+        else:
+            if cached.inflight is None:
+                cached.misses += 1
+                cached.inflight = asyncio.ensure_future(self._fetch(url, cached))
+                cached.inflight.add_done_callback(lambda _: setattr(cached, "inflight", None))
+            else:
+                cached.coalesced += 1
+            # Shielded so one client going away does not cancel the fetch for the others
+            status, content_type, body = await asyncio.shield(cached.inflight)
+        return web.Response(status=status, body=body, content_type=content_type)
+
+    async def pass_through(self, url):
+        """Concurrent requests for the same url share one upstream request, nothing is kept
+        once it is answered"""
+        inflight = self.passing.get(url)
+        if inflight is None:
+            self.passed.misses += 1
+            inflight = self.passing[url] = asyncio.ensure_future(self._fetch(url, self.passed))
+            inflight.add_done_callback(lambda _: self.passing.pop(url, None))
+        else:
+            self.passed.coalesced += 1
+        status, content_type, body = await asyncio.shield(inflight)
+        return web.Response(status=status, body=body, content_type=content_type)
+
+    async def handle_stats(self, request):
+        now = time.monotonic()
+        stats = {url: cached.stats(now) for url, cached in self.responses.items()}
+        stats["passthrough"] = self.passed.stats(now)
+        return web.json_response(
+            stats,
+            dumps=lambda data: json.dumps(data, indent=2),
+        )
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get(STATS_PATH, self.handle_stats)
+        app.router.add_get("/{path:.*}", self.handle)
+        app.on_startup.append(self.start)
+        app.on_cleanup.append(self.stop)
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Caching proxy for the Sunpower PVS")
+    parser.add_argument("--pvs", default=DEFAULT_PVS, help="PVS host[:port] to proxy")
+    parser.add_argument("--listen", default="0.0.0.0", help="address to listen on")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="port to listen on")
+    parser.add_argument(
+        "--device-list-ttl",
+        type=int,
+        default=DEFAULT_DEVICE_LIST_TTL,
+        help="seconds to cache DeviceList",
+    )
+    parser.add_argument(
+        "--ess-ttl",
+        type=int,
+        default=DEFAULT_ESS_TTL,
+        help="seconds to cache the energy storage status",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=int,
+        default=DEFAULT_TIMEOUT,
+        help="seconds to wait for the PVS",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    proxy = PVSProxy(args.pvs, args.device_list_ttl, args.ess_ttl, args.timeout)
+    web.run_app(proxy.app(), host=args.listen, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
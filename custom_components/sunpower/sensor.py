@@ -1,159 +1,111 @@
 """Support for Sunpower sensors."""
 
 import logging
+from datetime import timedelta
 
 from homeassistant.components.sensor import (
     SensorDeviceClass,
     SensorEntity,
 )
+from homeassistant.core import callback
+from homeassistant.helpers.event import async_track_time_interval
 
 from .const import (
     DOMAIN,
-    ESS_DEVICE_TYPE,
     PVS_DEVICE_TYPE,
     SUNPOWER_COORDINATOR,
-    SUNPOWER_DESCRIPTIVE_NAMES,
-    SUNPOWER_PRODUCT_NAMES,
-    SUNPOWER_SENSORS,
-    SUNVAULT_SENSORS,
 )
-from .entity import SunPowerEntity
+from .descriptors import (
+    POLL_SENSOR_DESCRIPTIONS,
+    SENSOR_DESCRIPTIONS,
+    SUNVAULT_SENSOR_DESCRIPTIONS,
+)
+from .entity import (
+    DeviceEntities,
+    SunPowerEntity,
+    title_names,
+)
 
 _LOGGER = logging.getLogger(__name__)
 
+# Poll diagnostics also move between polls (budget refills) and while polls keep failing,
+# which the coordinator does not notify about, so they are checked on their own as well
+POLL_SENSOR_INTERVAL = timedelta(seconds=60)
+
+
+def create_sensor(coordinator, device, parent, description, title):
+    """A sensor for one described field of a device, None when the device does not report it"""
+    sensor = SunPowerSensor(coordinator, device, parent, description, title)
+    return sensor if sensor.native_value is not None else None
+
 
 async def async_setup_entry(hass, config_entry, async_add_entities):
     """Set up the Sunpower sensors."""
     sunpower_state = hass.data[DOMAIN][config_entry.entry_id]
     _LOGGER.debug("Sunpower_state: %s", sunpower_state)
 
-    do_descriptive_names = False
-    if SUNPOWER_DESCRIPTIVE_NAMES in config_entry.data:
-        do_descriptive_names = config_entry.data[SUNPOWER_DESCRIPTIVE_NAMES]
-
-    do_product_names = False
-    if SUNPOWER_PRODUCT_NAMES in config_entry.data:
-        do_product_names = config_entry.data[SUNPOWER_PRODUCT_NAMES]
-
-    coordinator = sunpower_state[SUNPOWER_COORDINATOR]
-    sunpower_data = coordinator.data
-
-    do_ess = False
-    if ESS_DEVICE_TYPE in sunpower_data:
-        do_ess = True
-    else:
-        _LOGGER.debug("Found No ESS Data")
-
-    if PVS_DEVICE_TYPE not in sunpower_data:
-        _LOGGER.error("Cannot find PVS Entry")
-    else:
-        entities = []
-
-        pvs = next(iter(sunpower_data[PVS_DEVICE_TYPE].values()))
-
-        SENSORS = SUNPOWER_SENSORS
-        if do_ess:
-            SENSORS.update(SUNVAULT_SENSORS)
-
-        for device_type in SENSORS:
-            if device_type not in sunpower_data:
-                _LOGGER.error(f"Cannot find any {device_type}")
+    device_entities = DeviceEntities(
+        sunpower_state,
+        config_entry,
+        SENSOR_DESCRIPTIONS,
+        SUNVAULT_SENSOR_DESCRIPTIONS,
+        create_sensor,
+    )
+    entities = device_entities.new_entities(log_missing=True)
+
+    pvs_data = sunpower_state[SUNPOWER_COORDINATOR].data
+    if PVS_DEVICE_TYPE in pvs_data:
+        pvs = next(iter(pvs_data[PVS_DEVICE_TYPE].values()))
+        names = {
+            **title_names(config_entry),
+            "SERIAL": pvs.get("SERIAL", "Unknown"),
+            "MODEL": pvs.get("MODEL", "Unknown"),
+        }
+        for description in POLL_SENSOR_DESCRIPTIONS:
+            poll_coordinator = sunpower_state[description.coordinator]
+            if poll_coordinator is None:
                 continue
-            unique_id = SENSORS[device_type]["unique_id"]
-            sensors = SENSORS[device_type]["sensors"]
-            for index, sensor_data in enumerate(sunpower_data[device_type].values()):
-                for sensor_name in sensors:
-                    sensor = sensors[sensor_name]
-                    sensor_type = (
-                        "" if not do_descriptive_names else f"{sensor_data.get('TYPE', '')} "
-                    )
-                    sensor_description = (
-                        "" if not do_descriptive_names else f"{sensor_data.get('DESCR', '')} "
-                    )
-                    text_sunpower = "" if not do_product_names else "SunPower "
-                    text_sunvault = "" if not do_product_names else "SunVault "
-                    text_pvs = "" if not do_product_names else "PVS "
-                    sensor_index = "" if not do_descriptive_names else f"{index + 1} "
-                    sunpower_sensor = SunPowerSensor(
-                        coordinator=coordinator,
-                        my_info=sensor_data,
-                        parent_info=pvs if device_type != PVS_DEVICE_TYPE else None,
-                        id_code=unique_id,
-                        device_type=device_type,
-                        field=sensor["field"],
-                        title=sensor["title"].format(
-                            index=sensor_index,
-                            TYPE=sensor_type,
-                            DESCR=sensor_description,
-                            SUN_POWER=text_sunpower,
-                            SUN_VAULT=text_sunvault,
-                            PVS=text_pvs,
-                            SERIAL=sensor_data.get("SERIAL", "Unknown"),
-                            MODEL=sensor_data.get("MODEL", "Unknown"),
-                        ),
-                        unit=sensor["unit"],
-                        icon=sensor["icon"],
-                        device_class=sensor["device"],
-                        state_class=sensor["state"],
-                        entity_category=sensor.get("entity_category", None),
-                    )
-                    if sunpower_sensor.native_value is not None:
-                        entities.append(sunpower_sensor)
-
-    async_add_entities(entities, True)
+            entities.append(
+                SunPowerPollSensor(
+                    sunpower_state.get(description.source, poll_coordinator),
+                    poll_coordinator,
+                    pvs,
+                    None,
+                    description,
+                    description.title.render(names),
+                ),
+            )
+
+    async_add_entities(entities)
+    device_entities.async_track(async_add_entities)
 
 
 class SunPowerSensor(SunPowerEntity, SensorEntity):
-    def __init__(
-        self,
-        coordinator,
-        my_info,
-        parent_info,
-        id_code,
-        device_type,
-        field,
-        title,
-        unit,
-        icon,
-        device_class,
-        state_class,
-        entity_category,
-    ):
-        """Initialize the sensor."""
-        super().__init__(coordinator, my_info, parent_info)
-        self._id_code = id_code
-        self._device_type = device_type
-        self._title = title
-        self._field = field
-        self._unit = unit
-        self._icon = icon
-        self._my_device_class = device_class
-        self._my_state_class = state_class
-        self._entity_category = entity_category
+    """One field of a device, as described by a SunPowerDescription"""
 
     @property
     def native_unit_of_measurement(self):
         """Return the unit of measurement."""
-        return self._unit
+        return self._description.unit
 
     @property
     def device_class(self):
         """Return device class."""
-        return self._my_device_class
+        return self._description.device_class
 
     @property
     def entity_category(self):
-        return self._entity_category
+        return self._description.entity_category
 
     @property
     def state_class(self):
         """Return state class."""
-        return self._my_state_class
+        return self._description.state_class
 
     @property
     def icon(self):
         """Icon to use in the frontend, if any."""
-        return self._icon
+        return self._description.icon
 
     @property
     def name(self):
@@ -176,12 +128,68 @@ class SunPowerSensor(SunPowerEntity, SensorEntity):
     @property
     def native_value(self):
         """Get the current value"""
-        if self._my_device_class == SensorDeviceClass.POWER_FACTOR:
-            try:
-                value = float(
-                    self.coordinator.data[self._device_type][self.base_unique_id][self._field],
-                )
-                return value * 100.0
-            except (ValueError, KeyError):
-                pass  # sometimes this value might be something like 'unavailable'
-        return self.coordinator.data[self._device_type][self.base_unique_id].get(self._field, None)
+        value = self.coordinator.data[self._device_type][self.base_unique_id].get(self._field)
+        if self._description.device_class == SensorDeviceClass.POWER_FACTOR and isinstance(
+            value,
+            (int, float),
+        ):
+            return value * 100.0
+        # sometimes a value might be something like 'unavailable', pass it through
+        return value
+
+
+class SunPowerPollSensor(SunPowerSensor):
+    """Diagnostics about polling a data source, _field is read from source (its coordinator
+    or the PVS monitor) and called with args when there are some"""
+
+    def __init__(self, source, *args):
+        """Initialize the sensor."""
+        super().__init__(*args)
+        self._source = source
+        self._args = self._description.args
+        self._last_value = None
+
+    async def async_added_to_hass(self):
+        """Also check the value every POLL_SENSOR_INTERVAL"""
+        await super().async_added_to_hass()
+        self.async_on_remove(
+            async_track_time_interval(
+                self.hass,
+                self._async_tick,
+                POLL_SENSOR_INTERVAL,
+            ),
+        )
+
+    @callback
+    def _async_tick(self, now):
+        """Runs in the event loop, a plain function would be run in the executor"""
+        self._handle_coordinator_update()
+
+    @callback
+    def _handle_coordinator_update(self):
+        """Write state only when the value moved, these describe the poll not the data"""
+        value = self.native_value
+        if value == self._last_value:
+            return
+        self._last_value = value
+        self.async_write_ha_state()
+
+    @property
+    def available(self):
+        """Most useful when polls are failing, so always available"""
+        return True
+
+    @property
+    def extra_state_attributes(self):
+        return None
+
+    @property
+    def unique_id(self):
+        """Device Uniqueid, _id_code names the poll diagnostic on the PVS device"""
+        return f"{self.base_unique_id}_poll_{self._id_code}"
+
+    @property
+    def native_value(self):
+        """Get the current value"""
+        value = getattr(self._source, self._field)
+        return value if self._args is None else value(*self._args)
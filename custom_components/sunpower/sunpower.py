@@ -1,7 +1,36 @@
 """ Basic Sunpower PVS Tool """
 
-import requests
-import simplejson
+import asyncio
+import codecs
+import json
+import math
+import random
+import re
+import time
+from collections import deque
+
+import aiohttp
+
+DEFAULT_TIMEOUT = 120
+DEFAULT_CACHE_TTL = 5
+LATENCY_WINDOW = 100
+ADAPTIVE_MIN_SAMPLES = 10
+ADAPTIVE_TIMEOUT_FACTOR = 3
+ADAPTIVE_MIN_TIMEOUT = 10
+DEFAULT_REQUESTS_PER_HOUR = 240
+GOVERNOR_BURST = 10
+GOVERNOR_FAILURE_THRESHOLD = 5
+GOVERNOR_OPEN_TIME = 900
+GOVERNOR_BACKOFF_BASE = 30
+GOVERNOR_BACKOFF_MAX = 480
+GOVERNOR_JITTER = 0.2
+
+DEVICE_LIST = "DeviceList"
+NETWORK_STATUS = "Get_Comm"
+ESS_STATUS = "energy_storage_system_status"
+# Timeout of commands that answer quickly, until one has been sent and timed, so e.g. the
+# config flow's probe of a new host fails in seconds rather than minutes
+STARTING_TIMEOUTS = {NETWORK_STATUS: 15}
 
 
 class ConnectionException(Exception):
@@ -12,43 +41,461 @@ class ParseException(Exception):
     """Any failure to connect to sunpower PVS"""
 
 
-class SunPowerMonitor:
-    """Basic Class to talk to sunpower pvs 5/6 via the management interface 'API'.
+class GovernorException(ConnectionException):
+    """The governor refused to call the PVS (budget spent, backing off or circuit open),
+    retry_after is how many seconds until it would let a request through"""
+
+    def __init__(self, message, retry_after=0):
+        """Initialize."""
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class PVSGovernor:
+    """Protects one PVS from its clients.
+    Every request spends a token from a bucket refilled at requests_per_hour (holding at most
+    burst tokens).  Consecutive failures back off exponentially with jitter, and a PVS that
+    keeps failing trips the circuit breaker: nothing is sent for open_time seconds, then a
+    single trial request decides whether it closes again."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    BACKOFF = "backoff"
+
+    def __init__(
+        self,
+        requests_per_hour=DEFAULT_REQUESTS_PER_HOUR,
+        burst=GOVERNOR_BURST,
+        failure_threshold=GOVERNOR_FAILURE_THRESHOLD,
+        open_time=GOVERNOR_OPEN_TIME,
+        backoff_base=GOVERNOR_BACKOFF_BASE,
+        backoff_max=GOVERNOR_BACKOFF_MAX,
+        jitter=GOVERNOR_JITTER,
+    ):
+        """Initialize."""
+        self.requests_per_hour = requests_per_hour
+        self.burst = burst
+        self.failure_threshold = failure_threshold
+        self.open_time = open_time
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.jitter = jitter
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.failures = 0
+        self.refused = 0
+        self.circuit = self.CLOSED
+        self.retry_at = 0.0
+
+    def _refill(self, now):
+        added = (now - self.updated) * self.requests_per_hour / 3600
+        self.tokens = min(self.burst, self.tokens + added)
+        self.updated = now
+
+    @property
+    def remaining(self):
+        """Requests that could be sent right now"""
+        self._refill(time.monotonic())
+        return int(self.tokens)
+
+    @property
+    def state(self):
+        """closed, backoff, open or half_open"""
+        if self.circuit == self.CLOSED and time.monotonic() < self.retry_at:
+            return self.BACKOFF
+        return self.circuit
+
+    def acquire(self):
+        """Spend a token for a request or raise GovernorException"""
+        now = time.monotonic()
+        if now < self.retry_at:
+            self.refused += 1
+            raise GovernorException(
+                "PVS {0}, retrying in {1:.0f}s".format(self.state, self.retry_at - now),
+                self.retry_at - now,
+            )
+        self._refill(now)
+        if self.tokens < 1:
+            self.refused += 1
+            raise GovernorException(
+                "PVS request budget spent",
+                (1 - self.tokens) * 3600 / self.requests_per_hour,
+            )
+        self.tokens -= 1
+        if self.circuit != self.CLOSED:
+            # Only this trial goes through, if it never reports back another follows later
+            self.circuit = self.HALF_OPEN
+            self.retry_at = now + self.open_time
+
+    def record_success(self):
+        self.failures = 0
+        self.circuit = self.CLOSED
+        self.retry_at = 0.0
+
+    def record_failure(self):
+        now = time.monotonic()
+        self.failures += 1
+        if self.circuit == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.circuit = self.OPEN
+            self.retry_at = now + self.open_time
+            return
+        backoff = min(self.backoff_base * 2 ** (self.failures - 1), self.backoff_max)
+        self.retry_at = now + backoff * random.uniform(1, 1 + self.jitter)
+
+
+class DeviceListDecoder:
+    """Decodes a DeviceList body as it arrives.
+    Every BATCH_SIZE characters the devices received whole so far are decoded and handed to
+    on_device, so decoding overlaps the (slow) transfer instead of starting once the last
+    byte is in and only text not decoded yet is buffered.  Without on_device the devices are
+    collected and close() returns the whole body, with it close() returns the body without
+    its devices so none of them are kept here."""
+
+    DEVICES = re.compile(r'"devices"\s*:\s*\[')
+    SEPARATORS = re.compile(r"[\s,]*")
+    ARRAY_END = re.compile(r"}\s*\]")
+    # Text buffered before decoding, small chunks are decoded together
+    BATCH_SIZE = 16384
+
+    def __init__(self, on_device=None):
+        """Initialize."""
+        self.devices = None if on_device is not None else []
+        self.on_device = on_device if on_device is not None else self.devices.append
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+        self._buffer = ""
+        # Chunks received since the last decode, joined once there are BATCH_SIZE of them
+        self._pending = []
+        self._pending_size = 0
+        self._head = None  # the body before the devices array, None until it is found
+        self._tail = None  # the body after it, None until the array is closed
+
+    def feed(self, chunk):
+        """Take in the next chunk of the body, as bytes"""
+        text = self._utf8.decode(chunk)
+        if self._tail is not None:
+            self._tail += text
+            return
+        self._pending.append(text)
+        self._pending_size += len(text)
+        if self._head is not None and self._pending_size < self.BATCH_SIZE:
+            return  # close() decodes whatever is left
+        self._buffer += "".join(self._pending)
+        self._pending.clear()
+        self._pending_size = 0
+        if self._head is None:
+            match = self.DEVICES.search(self._buffer)
+            if match is None:
+                return
+            start, end = match.span()
+            self._head = self._buffer[:start] + '"devices":'
+            self._buffer = self._buffer[end:]
+        self._decode_devices()
+
+    def _decode_devices(self):
+        """Devices are flat objects, so everything up to the last closing brace is normally
+        whole devices and is decoded in one call, when it is not (a brace inside a string,
+        the end of the array) they are decoded one at a time"""
+        buffer = self._buffer
+        start = self.SEPARATORS.match(buffer).end()
+        match = self.ARRAY_END.search(buffer, start)
+        end = match.start() + 1 if match is not None else buffer.rfind("}") + 1
+        if end <= start or buffer.startswith("]", start):
+            self._decode_each(buffer, start)
+            return
+        try:
+            devices = json.loads("[" + buffer[start:end] + "]")
+        except ValueError:
+            self._decode_each(buffer, start)
+            return
+        for device in devices:
+            self.on_device(device)
+        self._decode_each(buffer, end)
+
+    def _decode_each(self, buffer, position):
+        while True:
+            # Skip to the next device or the end of the array
+            position = self.SEPARATORS.match(buffer, position).end()
+            if position == len(buffer):
+                break
+            if buffer[position] == "]":
+                self._tail = buffer[position:][1:]
+                position = len(buffer)
+                break
+            try:
+                device, position = self._json.raw_decode(buffer, position)
+            except ValueError:
+                break  # not all of it has arrived yet, or it is broken and close() says so
+            self.on_device(device)
+        self._buffer = buffer[position:]
+
+    def close(self):
+        """The decoded body once every chunk has been fed, raises ValueError when it is not
+        valid json or, with on_device, has no device list"""
+        self._pending.append(self._utf8.decode(b"", final=True))
+        self._buffer += "".join(self._pending)
+        if self._head is None and self.devices is None:
+            raise ValueError("No device list in DeviceList")
+        if self._head is None:
+            return json.loads(self._buffer)  # no device list, e.g. an error response
+        if self._tail is None:
+            self._decode_devices()
+        if self._tail is None:
+            raise ValueError("DeviceList ended inside its device array")
+        data = json.loads(self._head + "[]" + self._tail)
+        if self.devices is None:
+            del data["devices"]
+        else:
+            data["devices"] = self.devices
+        return data
+
+
+class CommandLatency:
+    """Rolling latency of one PVS command, a timed out request counts as the time it waited"""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        """Initialize."""
+        self.samples = deque(maxlen=window)
+        self.timeouts = 0
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+
+    def percentile(self, percent):
+        """Nearest rank percentile in seconds, None before the first request"""
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[max(math.ceil(percent / 100 * len(ordered)), 1) - 1]
+
+
+class AsyncSunPowerMonitor:
+    """Asyncio Class to talk to sunpower pvs 5/6 via the management interface 'API'.
+    All requests go through one pooled keep-alive aiohttp session.  Pass in a session to
+    share one (e.g. per config entry), otherwise one is created and owned by this object
+    and must be released with close().
+    Concurrent requests for the same url share one in flight request and a successful
+    result is reused for cache_ttl seconds, so a burst of refreshes costs one PVS call, and
+    dropped after that.
+    DeviceList is decoded while it streams in, see DeviceListDecoder.  device_list can hand
+    each device to a collector as it is decoded instead, the collector is then the result
+    shared and cached for every caller passing the same collector factory.
+    Results may be shared, callers must not modify them.
+    The latency of each command is tracked, with adaptive_timeout each command times out
+    after a multiple of its own observed p99 instead of always waiting the full timeout.
+    With a governor every request sent to the PVS (not cached or coalesced ones) goes
+    through it, share one governor between every client of the same PVS.
     This is not a public API so it might fail at any time.
     if you find this useful please complain to sunpower and your sunpower dealer that they
     do not have a public API"""
 
-    def __init__(self, host):
+    def __init__(
+        self,
+        host,
+        session=None,
+        timeout=DEFAULT_TIMEOUT,
+        cache_ttl=DEFAULT_CACHE_TTL,
+        adaptive_timeout=False,
+        governor=None,
+    ):
         """Initialize."""
         self.host = host
         self.command_url = "http://{0}/cgi-bin/dl_cgi?Command=".format(host)
+        self.ess_url = "http://{0}/cgi-bin/dl_cgi/energy-storage-system/status".format(host)
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.adaptive_timeout = adaptive_timeout
+        self.governor = governor
+        self.latencies = {}  # command -> CommandLatency
+        self._session = session
+        self._owns_session = session is None
+        # Keyed by url, or (url, collector factory) for collected DeviceLists
+        self._inflight = {}  # key -> task fetching it
+        self._results = {}  # key -> (monotonic time fetched, decoded json or collector)
+        self._expiries = {}  # key -> timer dropping its result
 
-    def generic_command(self, command):
-        """All 'commands' to the PVS module use this url pattern and return json
-        The PVS system can take a very long time to respond so timeout is at 2 minutes"""
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    @property
+    def session(self):
+        """The shared session, created on first use when one was not supplied"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit_per_host=2, keepalive_timeout=300),
+            )
+            self._owns_session = True
+        return self._session
+
+    async def close(self):
+        """Close the session if we own it, aborting anything still in flight"""
+        for task in self._inflight.values():
+            task.cancel()
+        for expiry in self._expiries.values():
+            expiry.cancel()
+        self._expiries.clear()
+        self._results.clear()
+        if self._owns_session and self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    def latency(self, command, percent):
+        """Percentile of the recent latency of a command in seconds"""
+        latency = self.latencies.get(command)
+        value = None if latency is None else latency.percentile(percent)
+        return None if value is None else round(value, 3)
+
+    def timeouts(self, command):
+        """How many requests for a command have timed out"""
+        latency = self.latencies.get(command)
+        return 0 if latency is None else latency.timeouts
+
+    def command_timeout(self, command):
+        """Seconds to wait for a command.  Its STARTING_TIMEOUTS entry before it has been
+        timed once, with adaptive_timeout and enough history a multiple of its p99, never
+        above timeout"""
+        latency = self.latencies.get(command)
+        if latency is None or not latency.samples:
+            return min(STARTING_TIMEOUTS.get(command, self.timeout), self.timeout)
+        if not self.adaptive_timeout:
+            return self.timeout
+        if len(latency.samples) < ADAPTIVE_MIN_SAMPLES:
+            return self.timeout
+        adaptive = max(latency.percentile(99) * ADAPTIVE_TIMEOUT_FACTOR, ADAPTIVE_MIN_TIMEOUT)
+        return min(adaptive, self.timeout)
+
+    async def _get_json(self, url, command, collect=None):
+        """GET a PVS url, answered from a fresh cached result or by joining the request
+        already in flight for it when there is one"""
+        key = url if collect is None else (url, collect)
+        cached = self._results.get(key)
+        if cached is not None and time.monotonic() - cached[0] < self.cache_ttl:
+            return cached[1]
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._inflight[key] = asyncio.ensure_future(
+                self._fetch_json(url, command, key, collect),
+            )
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Shielded so one caller being cancelled does not abort the request for the others
+        return await asyncio.shield(task)
+
+    async def _fetch_json(self, url, command, key, collect=None):
+        """GET a PVS url and decode the json body, with collect DeviceList devices go to the
+        collector it returns and that is the result.
+        The PVS system can take a very long time to respond so timeout is at 2 minutes.
+        Cancellation (e.g. on config entry unload) propagates untouched."""
+        if self.governor is not None:
+            self.governor.acquire()
+        latency = self.latencies.setdefault(command, CommandLatency())
+        timeout = self.command_timeout(command)
+        start = time.monotonic()
         try:
-            return requests.get(self.command_url + command, timeout=120).json()
-        except requests.exceptions.RequestException as error:
+            async with self.session.get(
+                url,
+                timeout=aiohttp.ClientTimeout(total=timeout),
+            ) as response:
+                response.raise_for_status()
+                if command == DEVICE_LIST:
+                    collector = None if collect is None else collect()
+                    decoder = DeviceListDecoder(None if collector is None else collector.add)
+                    async for chunk in response.content.iter_any():
+                        decoder.feed(chunk)
+                else:
+                    collector = decoder = None
+                    body = await response.text()
+        except asyncio.TimeoutError as error:
+            latency.timeouts += 1
+            latency.record(time.monotonic() - start)
+            self._record_failure()
+            raise ConnectionException from error
+        except aiohttp.ClientError as error:
+            self._record_failure()
             raise ConnectionException from error
-        except simplejson.errors.JSONDecodeError as error:
+        latency.record(time.monotonic() - start)
+        if self.governor is not None:
+            # The PVS answered, even if what it said does not parse
+            self.governor.record_success()
+        try:
+            data = json.loads(body) if decoder is None else decoder.close()
+        except ValueError as error:
             raise ParseException from error
+        if collector is not None:
+            collector.close()
+            data = collector
+        self._results[key] = (time.monotonic(), data)
+        # Dropped once stale so a large body is not held until the url is requested again
+        expiry = self._expiries.pop(key, None)
+        if expiry is not None:
+            expiry.cancel()
+        self._expiries[key] = asyncio.get_running_loop().call_later(
+            self.cache_ttl,
+            self._expire,
+            key,
+        )
+        return data
+
+    def _expire(self, key):
+        del self._expiries[key]
+        del self._results[key]
+
+    def _record_failure(self):
+        if self.governor is not None:
+            self.governor.record_failure()
+
+    async def generic_command(self, command):
+        """All 'commands' to the PVS module use this url pattern and return json"""
+        return await self._get_json(self.command_url + command, command)
+
+    async def device_list(self, collect=None):
+        """Get a list of all devices connected to the PVS.
+        With collect, a factory of collectors (objects with add(device) and close()), each
+        device is added to a new collector as soon as it is decoded, and that collector is
+        returned once closed instead of the body.  ParseException is raised when there is no
+        device list.  Callers passing the same factory share the request and collector."""
+        return await self._get_json(self.command_url + DEVICE_LIST, DEVICE_LIST, collect)
+
+    async def energy_storage_system_status(self):
+        """Get the status of the energy storage system"""
+        return await self._get_json(self.ess_url, ESS_STATUS)
+
+    async def network_status(self):
+        """Get a list of network interfaces on the PVS"""
+        return await self.generic_command(NETWORK_STATUS)
+
+
+class SunPowerMonitor:
+    """Blocking wrapper around AsyncSunPowerMonitor for scripts and the command line.
+    Each call runs its own event loop and session, so calls are not coalesced or cached,
+    do not use this inside Home Assistant."""
+
+    def __init__(self, host, timeout=DEFAULT_TIMEOUT):
+        """Initialize."""
+        self.host = host
+        self.timeout = timeout
+
+    def _run(self, method, *args):
+        async def runner():
+            async with AsyncSunPowerMonitor(self.host, timeout=self.timeout) as monitor:
+                return await getattr(monitor, method)(*args)
+
+        return asyncio.run(runner())
+
+    def generic_command(self, command):
+        """All 'commands' to the PVS module use this url pattern and return json"""
+        return self._run("generic_command", command)
 
     def device_list(self):
         """Get a list of all devices connected to the PVS"""
-        return self.generic_command("DeviceList")
+        return self._run("device_list")
 
     def energy_storage_system_status(self):
         """Get the status of the energy storage system"""
-        try:
-            return requests.get(
-                "http://{0}/cgi-bin/dl_cgi/energy-storage-system/status".format(self.host),
-                timeout=120,
-            ).json()
-        except requests.exceptions.RequestException as error:
-            raise ConnectionException from error
-        except simplejson.errors.JSONDecodeError as error:
-            raise ParseException from error
+        return self._run("energy_storage_system_status")
 
     def network_status(self):
         """Get a list of network interfaces on the PVS"""
-        return self.generic_command("Get_Comm")
+        return self._run("network_status")